@@ -2,9 +2,12 @@ from .bitbank import bitbank_get_trades, bitbank_trades_to_historical, bitbank_m
 from .bitget import bitget_fetch_trades
 from .binance import binance_get_OI, binance_get_buy_sell_vol, binance_get_trades, binance_make_ohlcv
 from .bitfinex import  bitfinex_get_trades
-from .bitflyer import bf_get_historical, bf_get_trades, bf_trades_to_historical, bf_make_ohlcv
+from .bitflyer import bf_get_historical, bf_get_trades, bf_trades_to_historical, bf_make_ohlcv, bf_make_ohlcv_multi
 from .bybit import bybit_make_ohlcv
-from .gmo import gmo_get_historical, gmo_get_trades, gmo_trades_to_historical, gmo_make_ohlcv
-from .util import pl_merge, make_ohlcv, make_ohlcv_from_timestamp, np_shift, np_stack, np_pct_change, np_pct_change_shift, pl_resample_ohlcv, resample_ohlc, trades_to_historical, df_list, list_to_pd
+from .gmo import gmo_get_historical, gmo_get_trades, gmo_trades_to_historical, gmo_make_ohlcv, gmo_make_ohlcv_range
+from .util import pl_merge, pl_fill_gaps, pl_ohlcv, ohlcv_schema, TRADE_SCHEMAS, EXTRA_AGGS, make_ohlcv, make_ohlcv_from_timestamp, scan_trades, pl_ohlcv_multi, make_ohlcv_multi, pl_bars, make_bars, np_shift, np_stack, np_pct_change, np_pct_change_shift, np_lag_matrix, pl_resample_ohlcv, resample_ohlc, trades_to_historical, df_list, list_to_pd
+from .rolling_util import np_rolling_sum, np_rolling_mean, np_rolling_std, np_rolling_zscore, np_rolling_min, np_rolling_max, np_ema
+from .http_util import http_get, set_rate_limit, set_cache
+from .io_util import read_table, scan_table, write_table, load_trades, load_ohlcv
 from .time_util import datetime_to_ms, datetime_to_timestamp, str_to_datetime
-from .analyze_util import Optimization, simple_regression, _simple_regression
\ No newline at end of file
+from .analyze_util import Optimization, make_pruner, batch_regression, simple_regression, _simple_regression
\ No newline at end of file
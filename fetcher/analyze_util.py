@@ -1,30 +1,405 @@
 import os
+import sys
+import multiprocessing
+import shutil
+import tempfile
 import numpy as np
+import polars as pl
 import plotly.graph_objs as go
 from plotly.subplots import make_subplots
 from matplotlib import pyplot as plt
-from abc import ABCMeta, abstractmethod
+from abc import ABCMeta
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+
+def _share_frame(df, path: str):
+    """
+    polars.DataFrameは非圧縮のArrow IPC, numpy.ndarrayは.npyで書き出して読み込み用のパスを返します
+    それ以外はNone(通常通りpickleされます)
+    """
+    if isinstance(df, pl.DataFrame):
+        df.write_ipc(f'{path}.arrow', compression='uncompressed')
+        return f'{path}.arrow'
+    if isinstance(df, np.ndarray):
+        np.save(f'{path}.npy', df)
+        return f'{path}.npy'
+    return None
+
+
+def _attach_frame(path: str):
+    # memory_mapで開くのでプロセス間でページキャッシュを共有し、コピーしない
+    if path.endswith('.arrow'):
+        return pl.read_ipc(path, memory_map=True)
+    return np.load(path, mmap_mode='r')
+
+
+def _optimize_worker(objective, study_name: str, storage_path: str, n_trials: int, sampler=None,
+                     pruner=None) -> None:
+    import optuna
+    from optuna.storages import JournalStorage
+    try:
+        from optuna.storages.journal import JournalFileBackend
+    except ImportError:
+        from optuna.storages import JournalFileStorage as JournalFileBackend
+
+    study = optuna.load_study(study_name=study_name, storage=JournalStorage(JournalFileBackend(storage_path)),
+                              sampler=sampler, pruner=pruner)
+    study.optimize(objective, n_trials=n_trials)
+
+
+def _nbytes(value) -> int:
+    """
+    キャッシュする値のおおよそのバイト数
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (pl.DataFrame, pl.Series)):
+        return value.estimated_size()
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value)
+    if isinstance(value, dict):
+        return sum(_nbytes(v) for v in value.values())
+    return sys.getsizeof(value)
+
+
+def _freeze(value):
+    """
+    キャッシュする配列を書き換えられないように読み取り専用にして返します
+    他のバッファのビュー(self.dfの列など)は呼び出し元の配列を変えないようにコピーしてから読み取り専用にします
+    """
+    if isinstance(value, np.ndarray):
+        if not value.flags.owndata:
+            value = value.copy()
+        value.flags.writeable = False
+        return value
+    if isinstance(value, (tuple, list)):
+        items = [_freeze(v) for v in value]
+        return type(value)(*items) if hasattr(value, '_fields') else type(value)(items)
+    return value
 
 
 class Optimization(metaclass=ABCMeta):
+    # memo()でキャッシュする中間結果の上限(バイト)
+    memo_bytes = 512 * 1024 ** 2
+
     def __init__(self, df: any, params: dict):
         if isinstance(df, list):
             self.df_list = df
         else:
             self.df = df
         self.params = params
+        self._shared = None
 
     def __call__(self, trial):
         # ハイパーパラメータの設定
         config = {}
         for key, value in self.params.items():
             config[key] = trial.suggest_int(key, value[0], value[1], step=value[2])
+        if self._use_folds():
+            return self._fold_trial(trial, config)
         return self.indicator(**config)
 
-    @abstractmethod
     def indicator(self, **kwargs):
+        """
+        評価値を返します. サブクラスで実装してください
+        indicator_foldを実装した場合はdf_listの全期間の平均になります
+        """
+        if self._use_folds():
+            return float(np.mean([self.indicator_fold(df, **kwargs) for df in self.df_list]))
+        raise NotImplementedError
+
+    def indicator_fold(self, df, **kwargs) -> float:
+        """
+        df_listの1期間分の評価値を返します
+        実装するとoptimizeは期間ごとにそれまでの平均をtrial.reportし、prunerの判定で見込みの無い試行を打ち切ります
+        example
+        class MyOptimization(Optimization):
+            def indicator_fold(self, df, length):
+                return sharpe(df, length)
+        study = MyOptimization(df_list(df, start, 30, 24, 'datetime'), {'length': (5, 200, 5)}).optimize(
+            n_trials=1000, pruner=make_pruner('halving'))
+        """
         raise NotImplementedError
 
+    def _use_folds(self) -> bool:
+        return hasattr(self, 'df_list') and type(self).indicator_fold is not Optimization.indicator_fold
+
+    def _fold_trial(self, trial, config: dict) -> float:
+        import optuna
+
+        total, value = 0.0, float('nan')
+        for step, df in enumerate(self.df_list):
+            total += self.indicator_fold(df, **config)
+            value = total / (step + 1)
+            trial.report(value, step)
+            if trial.should_prune():
+                raise optuna.TrialPruned()
+        return value
+
+    def indicator_batch(self, **kwargs) -> np.ndarray:
+        """
+        grid_searchで使う一括評価. kwargsは各パラメータの同じ長さの配列(組み合わせごとの値)です
+        サブクラスでパラメータの値ごとの指標を2次元配列にまとめてブロードキャストで評価するように上書きしてください
+        デフォルトは組み合わせごとにindicatorを呼びます
+        :return: 組み合わせごとの評価値の配列
+        """
+        keys = list(kwargs)
+        n = len(kwargs[keys[0]]) if keys else 0
+        return np.array([self.indicator(**{key: kwargs[key][i].item() for key in keys}) for i in range(n)],
+                        dtype=np.float64)
+
+    def param_grid(self) -> dict:
+        """
+        paramsの全ての組み合わせを返します. 範囲はtrial.suggest_intと同じくlowからstep刻みでhighまでです
+        :return: {パラメータ名: 組み合わせごとの値の配列}
+        """
+        axes = [np.arange(value[0], value[1] + 1, value[2]) for value in self.params.values()]
+        mesh = np.meshgrid(*axes, indexing='ij')
+        return {key: m.ravel() for key, m in zip(self.params, mesh)}
+
+    def grid_search(self, batch_size: int = None, direction: str = 'maximize') -> pl.DataFrame:
+        """
+        paramsの全ての組み合わせをindicator_batchで評価します
+        example
+        result = MyOptimization(df, {'length': (5, 200, 5), 'threshold': (1, 50, 1)}).grid_search()
+        print(result.head())
+        :param batch_size: 一度にindicator_batchへ渡す組み合わせの数. 省略した場合は全て一度に渡します
+        :param direction: maximize, minimize (結果の並び順)
+        :return: パラメータとvalueの列を評価値の良い順に並べたpolars.DataFrame
+        """
+        grid = self.param_grid()
+        n = len(next(iter(grid.values()))) if grid else 0
+        batch_size = batch_size or max(n, 1)
+        values = np.empty(n, dtype=np.float64)
+        for start in range(0, n, batch_size):
+            batch = {key: v[start:start + batch_size] for key, v in grid.items()}
+            values[start:start + batch_size] = self.indicator_batch(**batch)
+        return (pl.DataFrame(grid)
+                # 評価できなかった組み合わせ(NaN)はnullにして最後に並べる
+                .with_columns(pl.Series('value', values, nan_to_null=True))
+                .sort('value', descending=direction == 'maximize', nulls_last=True))
+
+    def memo(self, key, func):
+        """
+        keyに対するfunc()の結果をキャッシュして返します. 合計がmemo_bytesを超えると最も古く使われたものから削除します
+        keyには結果が依存するパラメータだけを含めてください. 返す配列は読み取り専用です
+        example
+        def indicator(self, length, threshold):
+            ema = self.memo(('ema', length), lambda: np_ema(self.close, span=length))
+            return np.mean(np.abs(self.close - ema) > threshold)
+        """
+        if getattr(self, '_memo', None) is None:
+            self.clear_memo()
+        if key in self._memo:
+            self._memo.move_to_end(key)
+            self._memo_hits += 1
+            return self._memo[key][0]
+
+        self._memo_misses += 1
+        value = func()
+        size = _nbytes(value)
+        if size > self.memo_bytes:
+            return value
+        value = _freeze(value)
+        self._memo[key] = (value, size)
+        self._memo_size += size
+        while self._memo_size > self.memo_bytes:
+            _, (_, old) = self._memo.popitem(last=False)
+            self._memo_size -= old
+        return value
+
+    def clear_memo(self) -> None:
+        self._memo = OrderedDict()
+        self._memo_size = 0
+        self._memo_hits = 0
+        self._memo_misses = 0
+
+    def memo_info(self) -> dict:
+        """
+        キャッシュのヒット数, ミス数, 件数, バイト数を返します
+        """
+        if getattr(self, '_memo', None) is None:
+            self.clear_memo()
+        return dict(hits=self._memo_hits, misses=self._memo_misses, entries=len(self._memo), bytes=self._memo_size)
+
+    def share(self, shared_dir: str = None) -> str:
+        """
+        self.df, self.df_listをshared_dirに1回だけ書き出します
+        以降はpickle(プロセスへの受け渡し)にパスだけを含め、各プロセスはmemory_mapでコピーせずに読み込みます
+        :return: 書き出したディレクトリ
+        """
+        if shared_dir is None:
+            shared_dir = tempfile.mkdtemp(prefix='fetcher-opt-')
+        os.makedirs(shared_dir, exist_ok=True)
+        shared = {}
+        if hasattr(self, 'df'):
+            path = _share_frame(self.df, os.path.join(shared_dir, 'df'))
+            if path is not None:
+                shared['df'] = path
+        if hasattr(self, 'df_list'):
+            paths = [_share_frame(df, os.path.join(shared_dir, f'df_{i}')) for i, df in enumerate(self.df_list)]
+            if all(path is not None for path in paths):
+                shared['df_list'] = paths
+        self._shared = shared
+        return shared_dir
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in (self._shared or {}):
+            state.pop(key, None)
+        # キャッシュは各プロセスで作り直す
+        state['_memo'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        for key, path in (self._shared or {}).items():
+            if key == 'df_list':
+                self.df_list = [_attach_frame(p) for p in path]
+            else:
+                self.df = _attach_frame(path)
+
+    def optimize(self, n_trials: int, n_jobs: int = 1, direction: str = 'maximize', study_name: str = None,
+                 storage_path: str = None, sampler=None, pruner=None):
+        """
+        optunaで最適化します
+        n_jobs > 1 の場合はプロセスプールで試行を並列に実行します. データはshare()で共有し、
+        試行の結果はJournalFileStorage(ファイル)で各プロセスが共有します
+        polarsのスレッドプールを起動した後のforkはデッドロックすることがあるため、プロセスはspawnで起動します
+        子プロセスはサブクラスをimportし直すので、Jupyter等の対話環境ではなくimportできるモジュールかスクリプトに定義し、
+        スクリプトではif __name__ == '__main__':の中から呼んでください
+        example
+        study = MyOptimization(df, {'length': (5, 200, 5)}).optimize(n_trials=1000, n_jobs=os.cpu_count())
+        print(study.best_params)
+        :param n_jobs: プロセス数
+        :param study_name: 省略した場合は自動で付けます
+        :param storage_path: ジャーナルファイルのパス. 指定した場合は最適化後も残り、続きから再開できます
+        :param sampler: optunaのsampler. 各プロセスで同じseedを使うと同じ点を探索するので注意してください
+        :param pruner: optunaのpruner. indicator_foldを実装した場合に期間ごとの途中結果で打ち切ります(make_pruner参照)
+                       省略した場合は打ち切りません
+        :return: optuna.Study
+        """
+        import optuna
+
+        if self._use_folds() and len(self.df_list) == 0:
+            raise ValueError('df_list is empty.')
+        # 省略時はoptunaのデフォルト(MedianPruner)ではなく打ち切らない
+        pruner = pruner or optuna.pruners.NopPruner()
+        if n_jobs <= 1:
+            study = optuna.create_study(study_name=study_name, direction=direction, sampler=sampler,
+                                        pruner=pruner)
+            study.optimize(self, n_trials=n_trials)
+            return study
+
+        from optuna.storages import JournalStorage
+        try:
+            from optuna.storages.journal import JournalFileBackend
+        except ImportError:
+            from optuna.storages import JournalFileStorage as JournalFileBackend
+
+        shared_dir = self.share()
+        try:
+            path = storage_path or os.path.join(shared_dir, 'journal.log')
+            storage = JournalStorage(JournalFileBackend(path))
+            study = optuna.create_study(study_name=study_name, storage=storage, direction=direction,
+                                        load_if_exists=True)
+            trials = [n_trials // n_jobs + (1 if i < n_trials % n_jobs else 0) for i in range(n_jobs)]
+            with ProcessPoolExecutor(max_workers=n_jobs,
+                                     mp_context=multiprocessing.get_context('spawn')) as executor:
+                futures = [executor.submit(_optimize_worker, self, study.study_name, path, n, sampler,
+                                           pruner)
+                           for n in trials if n > 0]
+                for future in futures:
+                    future.result()
+
+            if storage_path is not None:
+                return optuna.load_study(study_name=study.study_name, storage=storage)
+            # 一時ファイルを消すのでメモリ上のstudyに写してから返す
+            memory = optuna.storages.InMemoryStorage()
+            optuna.copy_study(from_study_name=study.study_name, from_storage=storage, to_storage=memory)
+            return optuna.load_study(study_name=study.study_name, storage=memory)
+        finally:
+            self._shared = None
+            shutil.rmtree(shared_dir, ignore_errors=True)
+
+
+def make_pruner(kind: str = 'halving', **kwargs):
+    """
+    indicator_foldで期間ごとに評価する場合のprunerを作ります
+    example
+    study = MyOptimization(df_list(df, start, 30, 24, 'datetime'), params).optimize(
+        n_trials=1000, pruner=make_pruner('median'))
+    :param kind: halving(SuccessiveHalvingPruner), median(MedianPruner)
+    :param kwargs: 各prunerの引数. 省略時は1期間目から判定します
+    """
+    import optuna
+
+    if kind == 'halving':
+        kwargs.setdefault('min_resource', 1)
+        return optuna.pruners.SuccessiveHalvingPruner(**kwargs)
+    if kind == 'median':
+        kwargs.setdefault('n_startup_trials', 5)
+        return optuna.pruners.MedianPruner(**kwargs)
+    raise ValueError(f'kind{kind} should be halving or median.')
+
+
+def batch_regression(X: np.ndarray, y: np.ndarray, min_periods: int = 3, chunk_size: int = 256) -> dict:
+    """
+    Xの各列とyの単回帰(y = slope * x + intercept)をまとめて計算します
+    列ごとにxとyのどちらかがNaNの行を除いて(np_stackと同じ)計算します
+    example
+    reg = batch_regression(features, target)
+    top = np.argsort(-np.abs(reg['ic']))[:20]
+    :param X: (n, k)の特徴量. 1次元の場合は1列として扱います
+    :param y: (n,)の目的変数
+    :param min_periods: 有効な行数がこれ未満の列はNaNになります
+    :param chunk_size: 一度に計算する列数(一時配列は n * chunk_size)
+    :return: ic, r2, slope, intercept, slope_se, intercept_se, sigma_y, n の配列(長さk)のdict
+    """
+    X = np.asarray(X, dtype=np.float64)
+    if X.ndim == 1:
+        X = X[:, None]
+    y = np.asarray(y, dtype=np.float64)
+    k = X.shape[1]
+    names = ('ic', 'r2', 'slope', 'intercept', 'slope_se', 'intercept_se', 'sigma_y', 'n')
+    result = {name: np.full(k, np.nan) for name in names}
+    y_valid = ~np.isnan(y)
+
+    for start in range(0, k, chunk_size):
+        x = X[:, start:start + chunk_size]
+        valid = ~np.isnan(x) & y_valid[:, None]
+        n = valid.sum(axis=0).astype(np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # 平均を引いてから2乗和を取り桁落ちを避ける
+            mx = np.where(valid, x, 0).sum(axis=0) / n
+            my = (np.where(y_valid, y, 0) @ valid) / n
+            dx = np.where(valid, x - mx, 0)
+            dy = np.where(valid, y[:, None] - my, 0)
+            sxx = np.einsum('ij,ij->j', dx, dx)
+            syy = np.einsum('ij,ij->j', dy, dy)
+            sxy = np.einsum('ij,ij->j', dx, dy)
+
+            slope = sxy / sxx
+            intercept = my - slope * mx
+            sigma_y = np.sqrt(np.maximum(syy - slope * sxy, 0) / (n - 2))
+            ic = sxy / np.sqrt(sxx * syy)
+
+        ok = n >= max(min_periods, 3)
+        cols = slice(start, start + x.shape[1])
+        result['n'][cols] = n
+        result['ic'][cols] = np.where(ok, ic, np.nan)
+        result['slope'][cols] = np.where(ok, slope, np.nan)
+        result['intercept'][cols] = np.where(ok, intercept, np.nan)
+        result['sigma_y'][cols] = np.where(ok, sigma_y, np.nan)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result['slope_se'][cols] = np.where(ok, sigma_y / np.sqrt(sxx), np.nan)
+            result['intercept_se'][cols] = np.where(ok, sigma_y * np.sqrt(1 / n + mx ** 2 / sxx), np.nan)
+
+    # simple_regressionと同じくr2はNaNを0にする
+    result['r2'] = np.nan_to_num(result['ic'] ** 2)
+    return result
+
 
 def simple_regression(x: np.ndarray, y: np.ndarray, plot_graph=False, title: str = "[Linear Regression]",
                       x_label: str = "x", y_label: str = "y", output_dir: str = None, save_fig: bool = False, plot_type: str = 'matplotlib'):
@@ -37,13 +412,12 @@ def simple_regression(x: np.ndarray, y: np.ndarray, plot_graph=False, title: str
     if not plot_graph:
         return r2
 
-    N = len(x)
-    p, cov = np.polyfit(x, y, 1, cov=True)
-    a = p[0]
-    b = p[1]
-    sigma_a = np.sqrt(cov[0, 0])
-    sigma_b = np.sqrt(cov[1, 1])
-    sigma_y = np.sqrt(1 / (N - 2) * np.sum([(a * xi + b - yi) ** 2 for xi, yi in zip(x, y)]))
+    reg = batch_regression(x, y)
+    a = reg['slope'][0]
+    b = reg['intercept'][0]
+    sigma_a = reg['slope_se'][0]
+    sigma_b = reg['intercept_se'][0]
+    sigma_y = reg['sigma_y'][0]
     yy = a * x + b
     if plot_type == 'matplotlib':
         fig = plt.figure()
@@ -157,13 +531,12 @@ def _simple_regression(x: np.ndarray, y: np.ndarray, plot_graph=False, title: st
     if not plot_graph:
         return r2
 
-    N = len(x)
-    p, cov = np.polyfit(x, y, 1, cov=True)
-    a = p[0]
-    b = p[1]
-    sigma_a = np.sqrt(cov[0, 0])
-    sigma_b = np.sqrt(cov[1, 1])
-    sigma_y = np.sqrt(1 / (N - 2) * np.sum([(a * xi + b - yi) ** 2 for xi, yi in zip(x, y)]))
+    reg = batch_regression(x, y)
+    a = reg['slope'][0]
+    b = reg['intercept'][0]
+    sigma_a = reg['slope_se'][0]
+    sigma_b = reg['intercept_se'][0]
+    sigma_y = reg['sigma_y'][0]
     yy = a * x + b
     if plot_type == 'matplotlib':
         fig = plt.figure()
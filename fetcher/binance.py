@@ -1,27 +1,30 @@
 import os
 import time
-import requests
 import pandas as pd
 import polars as pl
+import pyarrow.parquet as pq
 from datetime import datetime, timedelta, timezone
-from .util import pl_merge, make_ohlcv_from_timestamp
+from concurrent.futures import ThreadPoolExecutor
+from .util import pl_fill_gaps, make_ohlcv_from_timestamp
 from .time_util import datetime_to_ms
+from .http_util import http_get
+from .io_util import table_path, write_table, append_table, last_timestamp
 
 
 def binance_get_1st_id(symbol, from_date):
     new_end_date = from_date + timedelta(seconds=60)
-    r = requests.get('https://fapi.binance.com/fapi/v1/aggTrades',
-                     params={
-                         "symbol": symbol,
-                         "startTime": datetime_to_ms(from_date),
-                         "endTime": datetime_to_ms(new_end_date)
-                     })
+    r = http_get('binance', 'https://fapi.binance.com/fapi/v1/aggTrades',
+                 params={
+                     "symbol": symbol,
+                     "startTime": datetime_to_ms(from_date),
+                     "endTime": datetime_to_ms(new_end_date)
+                 }, weight=20)
 
     if r.status_code != 200:
         print('somethings wrong!', r.status_code)
         print('sleeping for 10s... will retry')
         time.sleep(10)
-        binance_get_1st_id(symbol, from_date)
+        return binance_get_1st_id(symbol, from_date)
 
     response = r.json()
     if len(response) > 0:
@@ -31,12 +34,12 @@ def binance_get_1st_id(symbol, from_date):
 
 
 def binance_fetch_trades(symbol, from_id):
-    r = requests.get("https://fapi.binance.com/fapi/v1/aggTrades",
-                     params={
-                         "symbol": symbol,
-                         "limit": 1000,
-                         "fromId": from_id
-                     })
+    r = http_get('binance', "https://fapi.binance.com/fapi/v1/aggTrades",
+                 params={
+                     "symbol": symbol,
+                     "limit": 1000,
+                     "fromId": from_id
+                 }, weight=20)
 
     if r.status_code != 200:
         print('somethings wrong!', r.status_code)
@@ -46,15 +49,109 @@ def binance_fetch_trades(symbol, from_id):
     return r.json()
 
 
+def _binance_iter_pages(symbol: str, from_id: int, to_ms: int, request_interval: float = 0, stop_id: int = None):
+    """
+    from_idからto_msまでのaggTradesを1ページ(最大1000件)ずつ返します
+    aggTrade id(a)は単調増加のため、前ページ以下のidを除くだけで重複が無くなります
+    :param stop_id: 指定した場合はこのidの手前で止めます(シャードの境界)
+    """
+    last_id = from_id - 1
+    while True:
+        try:
+            trades = binance_fetch_trades(symbol, last_id + 1)
+            current_time = trades[-1]['T']
+        except Exception as e:
+            print(f'{e}\nsomethings wrong....... sleeping for 15s')
+            time.sleep(15)
+            continue
+
+        page = (
+            pl.DataFrame(trades)
+            .with_columns([pl.col('p').cast(pl.Float64), pl.col('q').cast(pl.Float64)])
+            .filter((pl.col('a') > last_id) & (pl.col('T') <= to_ms))
+        )
+        if stop_id is not None:
+            page = page.filter(pl.col('a') < stop_id)
+        last_id = trades[-1]['a']
+
+        print("\r" +
+              f'fetched {len(trades)} trades from id {last_id} @ {datetime.fromtimestamp(current_time / 1000.0, tz=timezone.utc)}',
+              end="")
+
+        if len(page) > 0:
+            yield page
+        if current_time >= to_ms or (stop_id is not None and last_id >= stop_id - 1):
+            break
+
+        if request_interval > 0:
+            time.sleep(request_interval)
+
+
+def _binance_shard_ids(symbol: str, from_date: datetime, to_date: datetime, shards: int) -> list:
+    """
+    [from_date, to_date)をshards個の区間に分け、各区間の最初のaggTrade idを返します
+    """
+    step = (to_date - from_date) / shards
+    with ThreadPoolExecutor(max_workers=shards) as executor:
+        return list(executor.map(lambda i: binance_get_1st_id(symbol, from_date + step * i), range(shards)))
+
+
+def _binance_fetch_shards(symbol: str, shard_ids: list, to_ms: int, request_interval: float, fetch_shard) -> list:
+    """
+    shard_ids[i] <= a < shard_ids[i+1] の範囲をfetch_shard(i, pages)で並列に処理します
+    リクエストは共有のレート制限を通るため、シャード数を増やしても制限は超えません
+    """
+    bounds = list(zip(shard_ids, shard_ids[1:] + [None]))
+    with ThreadPoolExecutor(max_workers=len(bounds)) as executor:
+        futures = [executor.submit(fetch_shard, i,
+                                   _binance_iter_pages(symbol, from_id, to_ms, request_interval, stop_id))
+                   for i, (from_id, stop_id) in enumerate(bounds)]
+        return [future.result() for future in futures]
+
+
+def _binance_write_pages(pages, path: str, row_group_size: int = 100_000) -> int:
+    """
+    ページをrow_group_size行ずつparquetへ追記します. メモリに載るのは1 row group分だけです
+    :return: 書き込んだ行数
+    """
+    writer = None
+    buffer = []
+    buffered = total = 0
+    try:
+        for page in pages:
+            buffer.append(page)
+            buffered += len(page)
+            if buffered >= row_group_size:
+                table = pl.concat(buffer).to_arrow()
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema, compression='zstd')
+                writer.write_table(table)
+                total += buffered
+                buffer, buffered = [], 0
+        if buffer:
+            table = pl.concat(buffer).to_arrow()
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema, compression='zstd')
+            writer.write_table(table)
+            total += buffered
+    finally:
+        if writer is not None:
+            writer.close()
+    return total
+
+
 def binance_get_trades(start_ymd: str, end_ymd: str = None, symbol: str = 'BTCUSDT', output_dir: str = None,
-                       request_interval: float = 0.5):
+                       request_interval: float = 0, streaming: bool = False, shards: int = 1, fmt: str = 'csv'):
     """binance 約定履歴
 
         start_ymd (str): 2022-08-08
         symbol (str, optional): Defaults to 'BTCUSDT'.
         end_ymd (str, optional): 指定しない場合はstartの1日後
         output_dir (str, optional): アウトプット先のフォルダ
-        request_interval (float, optional): 待機時間
+        request_interval (float, optional): 追加の待機時間. レート制限はhttp_utilで管理します
+        streaming (bool, optional): Trueの場合はページ毎に{start_ymd}.parquetへ追記し、メモリ使用量を一定に保ちます
+        shards (int, optional): 期間をshards個に分割して並列に取得します. 各区間はaggTrade idで連結します
+        fmt (str, optional): csv, parquet. streamingの場合は常にparquetです
     """
     if output_dir is None:
         output_dir = f'binance/trades/{symbol}'
@@ -66,7 +163,48 @@ def binance_get_trades(start_ymd: str, end_ymd: str = None, symbol: str = 'BTCUS
     else:
         to_date = datetime.strptime(end_ymd, "%Y-%m-%d") - timedelta(microseconds=1)
     from_date = datetime.strptime(start_ymd, "%Y-%m-%d")
+
+    if shards > 1:
+        to_ms = datetime_to_ms(to_date)
+        shard_ids = _binance_shard_ids(symbol, from_date, to_date, shards)
+        print(f'shard ids: {shard_ids}')
+        if streaming:
+            path = table_path(output_dir, start_ymd, 'parquet')
+
+            def write_shard(i, pages):
+                part = f'{path}.part{i}'
+                return part if _binance_write_pages(pages, part) > 0 else None
+
+            parts = [part for part in _binance_fetch_shards(symbol, shard_ids, to_ms, request_interval, write_shard)
+                     if part is not None]
+            # シャードはidの昇順に並んでいるため、順番に書き写すだけで連結できます
+            rows = _binance_write_pages((pl.from_arrow(batch) for part in parts
+                                         for batch in pq.ParquetFile(part).iter_batches()), path)
+            for part in parts:
+                os.remove(part)
+        else:
+            path = table_path(output_dir, start_ymd, fmt)
+            shard_pages = _binance_fetch_shards(symbol, shard_ids, to_ms, request_interval,
+                                                lambda i, pages: list(pages))
+            df = pl.concat([page for pages in shard_pages for page in pages])
+            gaps = df.select((pl.col('a').diff() != 1).sum()).item()
+            if gaps > 0:
+                print(f'\n[Warning] {gaps} gaps found in aggTrade ids')
+            # csvはshards=1と同じくpandasのindex列を先頭に付けた形式で保存する
+            write_table(df.to_pandas() if fmt == 'csv' else df, path)
+            rows = len(df)
+        print(f'\n[Output File] --> {path} ({rows} rows)\nfile created!')
+        return
+
     from_id = binance_get_1st_id(symbol, from_date)
+
+    if streaming:
+        path = table_path(output_dir, start_ymd, 'parquet')
+        rows = _binance_write_pages(_binance_iter_pages(symbol, from_id, datetime_to_ms(to_date), request_interval),
+                                    path)
+        print(f'\n[Output File] --> {path} ({rows} rows)\nfile created!')
+        return
+
     current_time = 0
     df = pd.DataFrame()
 
@@ -83,8 +221,8 @@ def binance_get_trades(start_ymd: str, end_ymd: str = None, symbol: str = 'BTCUS
 
             df = pd.concat([df, pd.DataFrame(trades)])
 
-            # don't exceed request limits
-            time.sleep(request_interval)
+            if request_interval > 0:
+                time.sleep(request_interval)
         except Exception as e:
             print(f'{e}\nsomethings wrong....... sleeping for 15s')
             time.sleep(15)
@@ -92,140 +230,101 @@ def binance_get_trades(start_ymd: str, end_ymd: str = None, symbol: str = 'BTCUS
     df.drop_duplicates(subset='a', inplace=True)
     # trim
     df = df[df['T'] <= datetime_to_ms(to_date)]
+    if fmt == 'parquet':
+        df = df.astype({'p': float, 'q': float})
 
-    df.to_csv(f'{output_dir}/{start_ymd}.csv')
+    path = table_path(output_dir, start_ymd, fmt)
+    write_table(df, path)
 
-    print(f'\n[Output File] --> {output_dir}/{start_ymd}.csv\nfile created!')
+    print(f'\n[Output File] --> {path}\nfile created!')
 
 
-def binance_get_OI(st_date: str, symbol: str = 'BTCUSDT', period: str = '5m', output_dir: str = None) -> None:
+def _binance_futures_data(url: str, st_date: str, symbol: str, period: str, output_dir: str, fmt: str) -> None:
+    """
+    futures/dataの統計を取得して{period}.{fmt}に保存します
+    既存ファイルがある場合は最終時刻だけを読み、それより新しい行だけを追記します
+    """
     start = time.time()
 
-    if output_dir is None:
-        output_dir = f'binance/{symbol}/OI'
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    path = f'{output_dir}/{period}.csv'
+    path = table_path(output_dir, period, fmt)
 
     if os.path.isfile(path):
         print(f"Found old data --> {path}\nDiff update...\n")
-        df_old = pd.read_csv(path, index_col='timestamp', parse_dates=True)
-        start_date = int(df_old.index[-1].timestamp() * 1000)
+        last_dt = last_timestamp(path, 'timestamp')
+        start_date = int(last_dt.timestamp() * 1000)
     else:
-        df_old = None
+        last_dt = None
         st_date = st_date.replace('/', '-')
         start_date = int(datetime.strptime(st_date, '%Y-%m-%d %H:%M:%S').timestamp() * 1000)
 
     print(f'Until  --> {datetime.fromtimestamp(start_date / 1000)}')
 
-    r = requests.get("https://fapi.binance.com/futures/data/openInterestHist",
-                     params=dict(symbol=symbol,
-                                 period=period,
-                                 limit=500,
-                                 startTime=start_date,
-                                 endTime=int(time.time()) * 1000))
+    r = http_get('binance_data', url,
+                 params=dict(symbol=symbol,
+                             period=period,
+                             limit=500,
+                             startTime=start_date,
+                             endTime=int(time.time()) * 1000))
     data = r.json()
+    if len(data) == 0:
+        print("no new data...")
+        return
     last_time = data[0]['timestamp'] - 1
-    df = pd.DataFrame(data)
+    frames = [pd.DataFrame(data)]
 
     while last_time >= start_date:
-        temp_r = requests.get("https://fapi.binance.com/futures/data/openInterestHist",
-                              params=dict(symbol=symbol,
-                                          period=period,
-                                          limit=500,
-                                          startTime=start_date,
-                                          endTime=last_time))
+        temp_r = http_get('binance_data', url,
+                          params=dict(symbol=symbol,
+                                      period=period,
+                                      limit=500,
+                                      startTime=start_date,
+                                      endTime=last_time))
         temp_data = temp_r.json()
         try:
             last_time = temp_data[0]['timestamp'] - 1
         except IndexError:
-            if os.path.isfile(path):
+            if last_dt is not None:
                 print("finish...")
             break
-        temp_df = pd.DataFrame(temp_data)
-        df = pd.concat([temp_df, df])
-        time.sleep(0.2)
+        frames.append(pd.DataFrame(temp_data))
 
-    df = df.set_index('timestamp')
+    df = pd.concat(frames[::-1]).set_index('timestamp')
     df.index = pd.to_datetime(df.index, unit='ms', utc=True).tz_localize(None)
-
-    if os.path.isfile(path):
-        df = pd.concat([df_old, df])
-        df = df.drop_duplicates()
-
-    df.to_csv(path)
+    df = df[~df.index.duplicated()].sort_index()
+    if fmt == 'parquet':
+        df = df.astype({col: float for col in df.columns if col != 'symbol'})
+
+    if last_dt is not None:
+        df = df[df.index > last_dt]
+        append_table(df, path)
+        print(f'Appended {len(df)} rows')
+    else:
+        write_table(df, path)
 
     print(f'Output --> {path}')
     print(f'elapsed time: {time.time() - start:.2f}sec')
 
 
-def binance_get_buy_sell_vol(st_date: str, symbol: str = 'BTCUSDT', period: str = '5m',
-                             output_dir: str = None) -> None:
-    start = time.time()
-
+def binance_get_OI(st_date: str, symbol: str = 'BTCUSDT', period: str = '5m', output_dir: str = None,
+                   fmt: str = 'csv') -> None:
     if output_dir is None:
-        output_dir = f'binance/{symbol}/buy_sell_vol'
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-
-    path = f'{output_dir}/{period}.csv'
-
-    if os.path.isfile(path):
-        print(f"Found old data --> {path}\nDiff update...\n")
-        df_old = pd.read_csv(path, index_col='timestamp', parse_dates=True)
-        start_date = int(df_old.index[-1].timestamp() * 1000)
-    else:
-        df_old = None
-        st_date = st_date.replace('/', '-')
-        start_date = int(datetime.strptime(st_date, '%Y-%m-%d %H:%M:%S').timestamp() * 1000)
-
-    print(f'Until  --> {datetime.fromtimestamp(start_date / 1000)}')
-
-    r = requests.get("https://fapi.binance.com/futures/data/takerlongshortRatio",
-                     params=dict(symbol=symbol,
-                                 period=period,
-                                 limit=500,
-                                 startTime=start_date,
-                                 endTime=int(time.time()) * 1000))
-    data = r.json()
-    last_time = data[0]['timestamp'] - 1
-    df = pd.DataFrame(data)
-
-    while last_time >= start_date:
-        temp_r = requests.get("https://fapi.binance.com/futures/data/takerlongshortRatio",
-                              params=dict(symbol=symbol,
-                                          period=period,
-                                          limit=500,
-                                          startTime=start_date,
-                                          endTime=last_time))
-        temp_data = temp_r.json()
-        try:
-            last_time = temp_data[0]['timestamp'] - 1
-        except IndexError:
-            if os.path.isfile(path):
-                print("finish...")
-
-        temp_df = pd.DataFrame(temp_data)
-        df = pd.concat([temp_df, df])
-        time.sleep(0.2)
-
-    df = df.set_index('timestamp')
-    df.index = pd.to_datetime(df.index, unit='ms', utc=True).tz_localize(None)
-
-    if os.path.isfile(path):
-        df = pd.concat([df_old, df])
-        df = df.drop_duplicates()
+        output_dir = f'binance/{symbol}/OI'
+    _binance_futures_data("https://fapi.binance.com/futures/data/openInterestHist",
+                          st_date, symbol, period, output_dir, fmt)
 
-    df.to_csv(path)
 
-    print(f'Output --> {path}')
-    print(f'elapsed time: {time.time() - start:.2f}sec')
+def binance_get_buy_sell_vol(st_date: str, symbol: str = 'BTCUSDT', period: str = '5m',
+                             output_dir: str = None, fmt: str = 'csv') -> None:
+    if output_dir is None:
+        output_dir = f'binance/{symbol}/buy_sell_vol'
+    _binance_futures_data("https://fapi.binance.com/futures/data/takerlongshortRatio",
+                          st_date, symbol, period, output_dir, fmt)
 
 
-def binance_make_ohlcv(path: str, time_frame, pl_type: pl.DataType=pl.Float64) -> pl.DataFrame:
-    df = make_ohlcv_from_timestamp(path, "T", "p", "q", "m", True, False, time_frame, pl_type, 1_000)
-    start_dt = datetime.combine(df["datetime"][0].date(), datetime.min.time())
-    end_dt = datetime.combine(df["datetime"][-1].date(), datetime.min.time()) + timedelta(days=1, seconds=-1)
-    dt_range = pl.DataFrame({'datetime': pl.datetime_range(start_dt, end_dt, time_frame, eager=True)})
-    return pl_merge(dt_range, df, "datetime")
\ No newline at end of file
+def binance_make_ohlcv(path: str, time_frame, pl_type: pl.DataType=pl.Float64, extra: list = None,
+                       streaming: bool = False) -> pl.DataFrame:
+    df = make_ohlcv_from_timestamp(path, "T", "p", "q", "m", True, False, time_frame, pl_type, 1_000, extra, streaming)
+    return pl_fill_gaps(df, time_frame).collect()
\ No newline at end of file
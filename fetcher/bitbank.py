@@ -1,31 +1,48 @@
 import os
+import json
 import time
-import requests
 import polars as pl
 from traceback import format_exc
 from datetime import datetime, timedelta
 from .time_util import str_to_datetime
-from .util import pl_merge
+from .util import pl_fill_gaps, pl_ohlcv, TRADE_SCHEMAS
+from .http_util import http_get, download
+from .io_util import table_path, write_table
 
 
-def bitbank_get_trades(st_date: str, symbol: str = "btc_jpy", output_dir: str = None) -> None:
+def _bitbank_transactions(pair: str, dt: datetime, cache: bool = True) -> list:
+    """
+    日別の約定履歴を返します. 日付(JST)が確定した過去分だけキャッシュします
+    """
+    completed = dt + timedelta(hours=16) < datetime.utcnow()
+    r = json.loads(download('bitbank', f'https://public.bitbank.cc/{pair}/transactions/{dt:%Y%m%d}',
+                            cache and completed))
+    return r['data']['transactions']
+
+
+def bitbank_get_trades(st_date: str, symbol: str = "btc_jpy", output_dir: str = None, fmt: str = 'csv') -> None:
     dt = str(st_date).replace("/", "-")
     st_date = str(st_date).replace("/", "").replace("-", "").replace(" 00:00:00", "")
-    r = requests.get(f"https://public.bitbank.cc/{symbol}/transactions/{st_date}").json()
+    r = http_get('bitbank', f"https://public.bitbank.cc/{symbol}/transactions/{st_date}").json()
 
     if output_dir is None:
         output_dir = f'bitbank/{symbol}/trades'
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    pl.DataFrame(r["data"]["transactions"]).write_csv(f"{output_dir}/{dt}.csv")
-    print(f'[Output File] --> {output_dir}/{dt}.csv\nfile created!')
+    df = pl.DataFrame(r["data"]["transactions"])
+    if fmt == 'parquet':
+        df = df.with_columns([pl.col("price").cast(pl.Float64), pl.col("amount").cast(pl.Float64)])
+    path = table_path(output_dir, dt, fmt)
+    write_table(df, path)
+    print(f'[Output File] --> {path}\nfile created!')
 
 
 def bitbank_trades_to_historical(start_ymd: str, end_ymd: str = None, symbol: str = 'btc_jpy',
                             period: str = '1s', price_pl_type: pl.DataType = pl.Float64,
                             size_pl_type: type = pl.Float64, output_dir: str = None,
-                            request_interval: float = 0.01, progress_info: bool = True) -> None:
+                            request_interval: float = 0, progress_info: bool = True, fmt: str = 'csv',
+                            cache: bool = True, extra: list = None) -> None:
 
     try:
         # 出力ディレクトリ設定
@@ -52,37 +69,15 @@ def bitbank_trades_to_historical(start_ymd: str, end_ymd: str = None, symbol: st
         total_count = 0
         while cur_dt <= end_dt:
             # csvパス
-            csv_path = os.path.join(output_dir, f"{cur_dt:%Y}-{cur_dt:%m}-{cur_dt:%d}.csv")
+            csv_path = table_path(output_dir, f"{cur_dt:%Y}-{cur_dt:%m}-{cur_dt:%d}", fmt)
             # csv存在チェック
             if os.path.isfile(csv_path):
                 cur_dt += timedelta(days=1)
                 continue
 
             try:
-                df = (pl.DataFrame(requests.get(f"https://public.bitbank.cc/{symbol}/transactions/{cur_dt:%Y%m%d}")
-                                   .json()["data"]["transactions"])
-                .lazy()
-                .with_columns([
-                (pl.col("executed_at") * 1_000).cast(pl.Datetime(time_unit='us')).alias('datetime'),
-                pl.col("price").cast(price_pl_type, strict=False),
-                pl.col("amount").cast(size_pl_type, strict=False)
-                ])
-                .with_columns([
-                pl.when(pl.col('side') == 'buy').then(pl.col('amount')).otherwise(0).alias('buy_size'),
-                pl.when(pl.col('side') == 'sell').then(pl.col('amount')).otherwise(0).alias('sell_size')
-                ])
-                .set_sorted("datetime")
-                .group_by_dynamic('datetime', every=period)
-                .agg([
-                pl.col("price").first().alias('open'),
-                pl.col("price").max().alias('high'),
-                pl.col("price").min().alias('low'),
-                pl.col("price").last().alias('close'),
-                pl.col("amount").sum().alias('volume'),
-                pl.col('buy_size').sum().alias('buy_vol'),
-                pl.col('sell_size').sum().alias('sell_vol'),
-                ])
-                ).collect()
+                df = pl_ohlcv(pl.DataFrame(_bitbank_transactions(symbol, cur_dt, cache)).lazy(),
+                              TRADE_SCHEMAS['bitbank'], period, price_pl_type, size_pl_type, extra).collect()
             except Exception as e:
                 print(f"{e}")
                 df = None
@@ -94,11 +89,11 @@ def bitbank_trades_to_historical(start_ymd: str, end_ymd: str = None, symbol: st
                     time.sleep(request_interval)
                 continue
 
-            df.write_csv(csv_path)
+            write_table(df, csv_path)
             total_count += 1
             if progress_info:
-                print(f'Completed output {csv_path}.csv')
-                print(f'[Output File] --> {csv_path}.csv\nfile created!')
+                print(f'Completed output {csv_path}')
+                print(f'[Output File] --> {csv_path}\nfile created!')
 
             cur_dt += timedelta(days=1)
             if request_interval > 0:
@@ -110,36 +105,13 @@ def bitbank_trades_to_historical(start_ymd: str, end_ymd: str = None, symbol: st
         print(f'save_daily_ohlcv_from_bitbank_trading failed.\n{format_exc()}')
         raise e
 
-def bitbank_make_ohlcv(pair, YYYYMMDD, time_frame, price_pl_type: pl.DataType = pl.Int64, size_pl_type: pl.DataType = pl.Float64) -> pl.DataFrame:
+def bitbank_make_ohlcv(pair, YYYYMMDD, time_frame, price_pl_type: pl.DataType = pl.Int64, size_pl_type: pl.DataType = pl.Float64,
+                       cache: bool = True, extra: list = None) -> pl.DataFrame:
     """
     約定履歴からohlcvを生成します
+    :param cache: 過去分の約定履歴をキャッシュします(http_util.set_cache参照)
+    :param extra: 追加で集計する列(util.EXTRA_AGGS参照)
     """
-    r = requests.get(f'https://public.bitbank.cc/{pair}/transactions/{YYYYMMDD}').json()
-
-    df = (pl.DataFrame(r['data']['transactions'])
-        .lazy()
-        .with_columns([(pl.col('executed_at') * 1000)
-                        .cast(pl.Datetime(time_unit='us')).alias("datetime"),
-                        pl.col('price').cast(price_pl_type),
-                        pl.col('amount').cast(size_pl_type),])
-        .with_columns([pl.when(pl.col('side') == 'buy')
-                        .then(pl.col('amount')).otherwise(0).alias('buy_size'),
-                        pl.when(pl.col('side') == 'sell')
-                        .then(pl.col('amount')).otherwise(0).alias('sell_size')])
-        .set_sorted("datetime")
-        .group_by_dynamic('datetime', every=time_frame)
-        .agg([
-            pl.col('price').first().alias('open'),
-            pl.col('price').max().alias('high'),
-            pl.col('price').min().alias('low'),
-            pl.col('price').last().alias('close'),
-            pl.col('amount').sum().alias('volume'),
-            pl.col('buy_size').sum().alias('buy_vol'),
-            pl.col('sell_size').sum().alias('sell_vol')
-        ])
-        .collect()
-        )
-    start_dt = datetime.combine(df["datetime"][0].date(), datetime.min.time())
-    end_dt = datetime.combine(df["datetime"][-1].date(), datetime.min.time()) + timedelta(days=1, seconds=-1)
-    dt_range = pl.DataFrame({'datetime': pl.datetime_range(start_dt, end_dt, time_frame, eager=True)})
-    return pl_merge(dt_range, df, "datetime")
\ No newline at end of file
+    df = pl_ohlcv(pl.DataFrame(_bitbank_transactions(pair, datetime.strptime(str(YYYYMMDD), '%Y%m%d'), cache)).lazy(),
+                  TRADE_SCHEMAS['bitbank'], time_frame, price_pl_type, size_pl_type, extra).collect()
+    return pl_fill_gaps(df, time_frame).collect()
\ No newline at end of file
@@ -1,12 +1,14 @@
 import os
 import time
-import requests
 import pandas as pd
 from datetime import datetime, timedelta
+from .http_util import http_get
+from .io_util import table_path, write_table, read_pd_table
 
 
 def bitfinex_get_trades(start_ymd: str, end_ymd: str = None, symbol: str = 'tBTCUSD',
-                        output_dir: str = None, progress_info: bool = True, update: bool = True) -> None:
+                        output_dir: str = None, progress_info: bool = True, update: bool = True,
+                        fmt: str = 'csv') -> None:
     """
     ※　日本時間の環境に合わせてます.
     時間掛かるので数日分取得する際は注意
@@ -16,6 +18,7 @@ def bitfinex_get_trades(start_ymd: str, end_ymd: str = None, symbol: str = 'tBTC
     :param symbol:
     :param output_dir:
     :param update:
+    :param fmt: csv, parquet
     :return:
     """
     start = time.time()
@@ -32,11 +35,11 @@ def bitfinex_get_trades(start_ymd: str, end_ymd: str = None, symbol: str = 'tBTC
         output_dir = f'bitfinex/{symbol}/trades'
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
-    path = f"{output_dir}/{end_ymd:%Y-%m-%d}.csv"
+    path = table_path(output_dir, f"{end_ymd:%Y-%m-%d}", fmt)
 
     if os.path.isfile(path) and update:
         print(f"Found old data --> {path}\nDifference update...\n")
-        df_old = pd.read_csv(path, index_col='datetime', parse_dates=True)
+        df_old = read_pd_table(path, 'datetime')
         df_old.index = df_old.index
         start_dt = df_old.index[-1].timestamp() + 1
     else:
@@ -50,16 +53,13 @@ def bitfinex_get_trades(start_ymd: str, end_ymd: str = None, symbol: str = 'tBTC
     print(
         f'output dir: {output_dir}  save term: {start_ymd - timedelta(hours=9)} -> {end_ymd - timedelta(hours=9)}')
 
-    r = requests.get(f'https://api-pub.bitfinex.com/v2/trades/{symbol}/hist', params=dict(
+    r = http_get('bitfinex', f'https://api-pub.bitfinex.com/v2/trades/{symbol}/hist', params=dict(
         limit=10000, start=start_dt, end=end_dt, sort=-1))
     data = r.json()
     df = pd.DataFrame(data)[::-1]
     last_time = data[-1][1] - 1
-    loop_time = 0
-    counter = 1
     while last_time >= start_dt:
-        start_loop_time = time.time()
-        temp_r = requests.get(f'https://api-pub.bitfinex.com/v2/trades/{symbol}/hist', params=dict(
+        temp_r = http_get('bitfinex', f'https://api-pub.bitfinex.com/v2/trades/{symbol}/hist', params=dict(
             limit=10000, start=start_dt, end=last_time, sort=-1))
         temp_data = temp_r.json()
         try:
@@ -72,13 +72,6 @@ def bitfinex_get_trades(start_ymd: str, end_ymd: str = None, symbol: str = 'tBTC
 
         temp_df = pd.DataFrame(temp_data)[::-1]
         df = pd.concat([temp_df, df])
-        counter += 1
-        loop_time += time.time() - start_loop_time
-        if counter % 30 == 0:
-            if progress_info:
-                print(f'------ waiting {60 - loop_time:.2f}sec ------')
-            time.sleep(60 - loop_time)
-            loop_time = 0
 
     df.rename(columns={0: 'ID', 1: 'datetime', 2: 'size', 3: 'price'}, inplace=True)
     df['datetime'] = df['datetime'] / 1000
@@ -87,7 +80,7 @@ def bitfinex_get_trades(start_ymd: str, end_ymd: str = None, symbol: str = 'tBTC
     df.index = df.index.tz_localize(None)
     if os.path.isfile(path) and update:
         df = pd.concat([df_old, df])
-    df.to_csv(path)
+    write_table(df, path)
 
     print(f'Output --> {path}')
     print(f'elapsed time: {(time.time() - start) / 60:.2f}min')
\ No newline at end of file
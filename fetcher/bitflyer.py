@@ -1,20 +1,27 @@
 import os
 import time
-import requests
+import bisect
+import itertools
+import threading
 import numpy as np
 import pandas as pd
 import  polars as pl
 from datetime import datetime, timedelta
 from pytz import utc
-from .util import make_ohlcv, pl_merge
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from .util import make_ohlcv, make_ohlcv_multi, pl_fill_gaps, pl_ohlcv, scan_trades, TRADE_SCHEMAS
 from .time_util import str_to_datetime
+from .http_util import http_get
+from .io_util import table_path, write_table, read_pd_table
 
 
 def bf_get_historical(st_date: str, symbol: str = 'FX_BTC_JPY', period: str = 'm',
-                      grouping: int = 1, output_dir: str = None) -> None:
+                      grouping: int = 1, output_dir: str = None, fmt: str = 'csv') -> None:
     """ example
     bf_get_historical('2021/09/01')
     :param output_dir: str
+    :param fmt: csv, parquet
     :param st_date: 2021/09/01
     :param symbol: FX_BTC_JPY, BTC_JPY, ETH_JPY
     :param period: m
@@ -28,14 +35,14 @@ def bf_get_historical(st_date: str, symbol: str = 'FX_BTC_JPY', period: str = 'm
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    path = f'{output_dir}/{datetime.now().strftime("%Y-%m-%d")}.csv'
+    path = table_path(output_dir, datetime.now().strftime("%Y-%m-%d"), fmt)
     now_str = datetime.now().strftime("%Y-%m-%d %H:%M")
     now = int(datetime.strptime(now_str, "%Y-%m-%d %H:%M").timestamp()) * 1000
     params = {'symbol': symbol, 'period': period, 'type': 'full', 'before': now, 'grouping': grouping}
 
     if os.path.isfile(path):
         print(f"Found old data --> {path}\nDifference update...\n")
-        df_old = pd.read_csv(path, index_col='time', parse_dates=True)
+        df_old = read_pd_table(path, 'time')
         start_date = int(df_old.index[-1].timestamp() * 1000)
     else:
         df_old = None
@@ -44,13 +51,13 @@ def bf_get_historical(st_date: str, symbol: str = 'FX_BTC_JPY', period: str = 'm
 
     print(f'Until  --> {datetime.fromtimestamp(start_date / 1000)}')
 
-    r = requests.get("https://lightchart.bitflyer.com/api/ohlc", params=params)
+    r = http_get('bitflyer', "https://lightchart.bitflyer.com/api/ohlc", params=params)
     data = r.json()
     last_time = data[-1][0] - params['grouping'] * 1000 * 2
 
     # while len(data) <= int(needTerm): 必要な期間が必要な時の実用例(100期間のEMAが欲しいなど
     while start_date <= last_time:
-        temp_r = requests.get("https://lightchart.bitflyer.com/api/ohlc", params=dict(
+        temp_r = http_get('bitflyer', "https://lightchart.bitflyer.com/api/ohlc", params=dict(
             symbol=params['symbol'], period=params['period'], before=last_time, grouping=params['grouping']))
         temp_data = temp_r.json()
         data.extend(temp_data)
@@ -62,24 +69,89 @@ def bf_get_historical(st_date: str, symbol: str = 'FX_BTC_JPY', period: str = 'm
         {'open': {'': np.nan}, 'high': {'': np.nan}, 'low': {'': np.nan}, 'close': {'': np.nan},
          'volume': {'': np.nan}}).dropna(how='any')
     df.index = pd.to_datetime(df.index, unit='ms', utc=True).tz_localize(None)
+    if fmt == 'parquet':
+        df = df.astype(float)
 
     if os.path.isfile(path):
         df = pd.concat([df_old, df])
         df = df.drop_duplicates()
 
-    df.to_csv(path)
+    write_table(df, path)
 
     print(f'Output --> {path}')
     print(f'elapsed time: {time.time() - start:.2f}sec')
 
 
-def bf_search_id(target_dt, symbol: str = "FX_BTC_JPY", count_id=14000):
-    def bf_date_to_dt():
-        try:
-            return datetime.strptime(response[0]["exec_date"] + "+0000", "%Y-%m-%dT%H:%M:%S.%f%z")
-        except ValueError:
-            return datetime.strptime(response[0]["exec_date"] + "+0000", "%Y-%m-%dT%H:%M:%S%z")
+def _bf_exec_ms(exec_date: str) -> int:
+    try:
+        dt = datetime.strptime(exec_date + "+0000", "%Y-%m-%dT%H:%M:%S.%f%z")
+    except ValueError:
+        dt = datetime.strptime(exec_date + "+0000", "%Y-%m-%dT%H:%M:%S%z")
+    return int(dt.timestamp() * 1000)
+
+
+_bf_anchors = {}
+_bf_anchors_lock = threading.Lock()
+
+
+def _bf_index_path(symbol: str, index_dir: str = None) -> str:
+    if index_dir is None:
+        index_dir = f'./bitflyer/{symbol}'
+    return f'{index_dir}/id_index.csv'
+
 
+def _bf_load_anchors(symbol: str, index_dir: str = None) -> tuple:
+    """
+    (約定id, exec_date[ms])のアンカーをid昇順で返します. 2回目以降はメモリから返します
+    """
+    path = _bf_index_path(symbol, index_dir)
+    with _bf_anchors_lock:
+        if path not in _bf_anchors:
+            ids, timestamps = [], []
+            if os.path.isfile(path):
+                anchors = sorted({(int(i), int(t)) for i, t in
+                                  (line.split(',') for line in open(path).read().splitlines()[1:] if line)})
+                ids = [i for i, _ in anchors]
+                timestamps = [t for _, t in anchors]
+            _bf_anchors[path] = (ids, timestamps)
+        return _bf_anchors[path]
+
+
+def bf_add_anchors(symbol: str, execs: list, index_dir: str = None) -> None:
+    """
+    getexecutionsのレスポンスから先頭と末尾の約定をアンカーとして索引に追加します
+    """
+    if not isinstance(execs, list) or len(execs) == 0:
+        return
+    ids, timestamps = _bf_load_anchors(symbol, index_dir)
+    path = _bf_index_path(symbol, index_dir)
+    new = []
+    with _bf_anchors_lock:
+        for ex in {execs[0]["id"]: execs[0], execs[-1]["id"]: execs[-1]}.values():
+            i = bisect.bisect_left(ids, ex["id"])
+            if i < len(ids) and ids[i] == ex["id"]:
+                continue
+            ts = _bf_exec_ms(ex["exec_date"])
+            ids.insert(i, ex["id"])
+            timestamps.insert(i, ts)
+            new.append(f'{ex["id"]},{ts}\n')
+        if new:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            is_new = not os.path.isfile(path)
+            with open(path, 'a') as f:
+                if is_new:
+                    f.write('id,timestamp\n')
+                f.writelines(new)
+
+
+def bf_search_id(target_dt, symbol: str = "FX_BTC_JPY", count_id=14000, index_dir: str = None):
+    """
+    target_dtより後の最初の約定IDを返します
+    約定ページを取得するたびに(id, exec_date)を索引に保存し、近いアンカー同士の間を補間探索します
+    :param count_id: 索引にアンカーが無い場合に仮定する1時間当たりのid数
+    :param index_dir: 索引の保存先. デフォルトは./bitflyer/{symbol}
+    :return: (約定ID, リクエスト回数)
+    """
     target_dt = target_dt.replace('/', '-')
     if len(target_dt) == 10:
         target_date = datetime.strptime(target_dt + " 00:00:00+0000", "%Y-%m-%d %H:%M:%S%z").astimezone(utc)
@@ -88,90 +160,176 @@ def bf_search_id(target_dt, symbol: str = "FX_BTC_JPY", count_id=14000):
         target_date = datetime.strptime(target_dt + "+0000", "%Y-%m-%d %H:%M:%S%z").astimezone(utc)
     else:
         raise ValueError
+    target_ms = int(target_date.timestamp() * 1000)
 
-    # target_dateと現在時刻のおおまかな時間差
-    hours = int((time.time() - target_date.timestamp()) / 3600) + 1
-
-    # 最新約定履歴ID取得
+    counter = 0
     params = dict(product_code=symbol, count=500)
-    response = requests.get("https://api.bitflyer.com/v1/getexecutions", params=params).json()
-    counter = 1
-    end_id = response[0]["id"]
-
-    # 二分探索開始ID設定
-    start_id = end_id - hours * count_id  # 平均count_id件/時間と仮定する
-
-    # start_idの約定履歴を取得
-    params["before"] = start_id + 1
-    response = requests.get("https://api.bitflyer.com/v1/getexecutions", params=params).json()
-    counter += 1
-
-    # start_idの約定日時(exec_date)をdatetime(UTC)変換
-    start_date = bf_date_to_dt()
-
-    # target_dateより過去日時になるまでstart_idをずらす
-    while start_date > target_date:
-        # 1時間分(count_id件)idを差し引いて約定履歴を再取得
-        start_id -= count_id
-        params["before"] = start_id + 1
-        response = requests.get("https://api.bitflyer.com/v1/getexecutions", params=params).json()
-        counter += 1
-
-        # start_idの約定日時(exec_date)をdatetime(UTC)変換
-        start_date = bf_date_to_dt()
-
-    # 検索範囲が500件以下になるまで絞り込み
-    while end_id - start_id > 500:
-        # idの中央値を算出
-        mid_id = int((start_id + end_id) / 2)
 
-        # 中央値の約定履歴を取得
-        params["before"] = mid_id + 1
-        response = requests.get("https://api.bitflyer.com/v1/getexecutions", params=params).json()
+    def fetch(before=None):
+        nonlocal counter
+        if before is None:
+            params.pop("before", None)
+        else:
+            params["before"] = before
+        response = http_get('bitflyer', "https://api.bitflyer.com/v1/getexecutions", params=params).json()
         counter += 1
-
-        # 中央値の約定日時(exec_date)をdatetime(UTC)変換
-        mid_date = bf_date_to_dt()
-
-        # mid_dateがtarget_dateの左右どちらかチェック
-        if mid_date < target_date:
-            # target_dateは中央値よりも右(未来)のため、start_idをずらす
-            start_id = mid_id
+        bf_add_anchors(symbol, response, index_dir)
+        # 約定履歴リストは新→古順のため、反転する
+        return [(ex["id"], _bf_exec_ms(ex["exec_date"])) for ex in response[::-1]]
+
+    # target_dateを挟むアンカー(lo: target以前, hi: targetより後)
+    ids, timestamps = _bf_load_anchors(symbol, index_dir)
+    with _bf_anchors_lock:
+        i = bisect.bisect_right(timestamps, target_ms)
+        lo = (ids[i - 1], timestamps[i - 1]) if i > 0 else None
+        hi = (ids[i], timestamps[i]) if i < len(ids) else None
+
+    # 索引より新しい場合は最新約定履歴を取得
+    if hi is None:
+        execs = fetch()
+        for ex in execs:
+            if target_ms < ex[1]:
+                hi = ex
+                break
         else:
-            # target_dateは中央値よりも左(過去)のため、end_idをずらす
-            end_id = mid_id
-
-
-    # 絞り込んだend_idまでの約定履歴を取得
-    params["before"] = end_id + 1
-    response = requests.get("https://api.bitflyer.com/v1/getexecutions", params=params).json()
-    counter += 1
+            return None, counter
+        if execs[0][1] <= target_ms:
+            return hi[0], counter
+        lo = None if lo is None or lo[0] >= execs[0][0] else lo
+
+    floor = lo[0] if lo is not None else 0  # floor以下のidに答えは無い
+    span = count_id // 12
+    step = 0
+    while True:
+        if lo is None:
+            # 索引より古い場合は平均count_id件/時間と仮定してさかのぼる
+            hours = int((hi[1] - target_ms) / 3_600_000) + 1
+            guess = hi[0] - hours * count_id
+        elif step % 3 == 2:
+            # 補間の進みが悪い時のために3回に1回は中央値
+            guess = (floor + hi[0]) // 2
+        else:
+            # アンカー間の線形補間
+            guess = lo[0] + int((target_ms - lo[1]) / (hi[1] - lo[1]) * (hi[0] - lo[0]))
+        step += 1
+        guess = min(max(guess, floor + 1), hi[0] - 1)
+        # 1ページ(約span件のid幅)の中央にguessが来るように取得する
+        before = hi[0] if hi[0] - floor <= span else min(guess + span // 2, hi[0] - 1) + 1
+        execs = fetch(before)
+        if len(execs) == 0:
+            floor = before - 1
+            lo = lo or (floor, target_ms)
+            if floor >= hi[0] - 1:
+                return hi[0], counter
+            continue
+        if len(execs) == 500:
+            span = max(500, execs[-1][0] - execs[0][0])
+
+        # ページがfloorまで届いていればfloor~beforeの約定は全てこのページにある
+        covered = len(execs) < 500 or execs[0][0] <= floor
+        if execs[0][1] > target_ms and not covered:
+            hi = execs[0]
+            continue
+        for ex in execs:
+            if target_ms < ex[1]:
+                return ex[0], counter
+        # ページ最新の約定からbeforeまでに他の約定は無い
+        lo = execs[-1]
+        floor = max(floor, before - 1)
+        if floor >= hi[0] - 1:
+            return hi[0], counter
+
+
+def _bf_fetch_block(symbol: str, lo: int, hi: int, index_dir: str = None) -> list:
+    """
+    lo <= id <= hi の約定履歴を昇順で返します
+    """
+    params = dict(product_code=symbol, count=500, before=hi + 1, after=lo - 1)
+    execs = []
+    while True:
+        r = http_get('bitflyer', 'https://api.bitflyer.com/v1/getexecutions', params=params).json()
+        if "error_message" in r:
+            raise Exception("API制限が掛かっています。300秒待機してから再実行してください。")
+        bf_add_anchors(symbol, r, index_dir)
+        execs.extend(r)
+        if len(r) < 500:
+            break
+        params["before"] = r[-1]["id"]
+    return execs[::-1]
 
-    # 約定履歴リストは新→古順のため、反転する
-    execs = response[::-1]
 
-    # 指定時刻後の最初のIDを検索
-    for ex in execs:
-        try:
-            ex_date = datetime.strptime(ex["exec_date"] + "+0000", "%Y-%m-%dT%H:%M:%S.%f%z")
-        except ValueError:
-            ex_date = datetime.strptime(ex["exec_date"] + "+0000", "%Y-%m-%dT%H:%M:%S%z")
-        if target_date < ex_date:
-            # 検索結果出力
-            return ex["id"], counter
+def _bf_write_days(df: pl.DataFrame, output_dir: str, start_dt: datetime, end_dt: datetime,
+                   limit_dt: datetime, fmt: str = 'csv') -> pl.DataFrame:
+    """
+    limit_dtより前の約定を日別csvに出力し、残りを返します
+    """
+    done = df.filter(pl.col("exec_date").lt(limit_dt))
+    done = done.filter((pl.col("exec_date").ge(start_dt)) & (pl.col("exec_date").lt(end_dt)))
+    if len(done) > 0:
+        for day_df in (done.with_columns(pl.col("exec_date").dt.date().alias("day"))
+                       .partition_by("day", maintain_order=True, include_key=False)):
+            path = table_path(output_dir, f'{day_df["exec_date"][0]:%Y-%m-%d}', fmt)
+            write_table(day_df, path)
+            print(f'\n[Output File] --> {path}')
+    return df.filter(pl.col("exec_date").ge(limit_dt))
 
 
-def bf_get_trades(start_ymd: str, end_ymd: str = None, symbol: str = 'FX_BTC_JPY', output_dir: str = None) -> None:
+def _bf_get_trades_parallel(symbol: str, start_id: int, end_id: int, start_dt: datetime, end_dt: datetime,
+                            output_dir: str, max_workers: int, index_dir: str = None, fmt: str = 'csv') -> None:
+    """
+    [start_id, end_id]をidブロックに分割して並列に取得し、日付が確定した分から日別csvを出力します
+    リクエストはhttp_utilの共有レート制限(500回/300秒)を通ります
+    """
+    # 直近1ページ分のid幅をブロックサイズにする(idは全銘柄共通のため銘柄ごとに密度が違う)
+    probe = http_get('bitflyer', 'https://api.bitflyer.com/v1/getexecutions',
+                     params=dict(product_code=symbol, count=500, before=end_id + 1)).json()
+    block_size = max(500, probe[0]["id"] - probe[-1]["id"] + 1)
+    blocks = iter([(lo, min(lo + block_size - 1, end_id)) for lo in range(start_id, end_id + 1, block_size)])
+    n_blocks = (end_id - start_id) // block_size + 1
+
+    buffer = []
+    buffer_day = None
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque(executor.submit(_bf_fetch_block, symbol, lo, hi, index_dir)
+                        for lo, hi in itertools.islice(blocks, max_workers * 2))
+        done = 0
+        while pending:
+            execs = pending.popleft().result()
+            for lo, hi in itertools.islice(blocks, 1):
+                pending.append(executor.submit(_bf_fetch_block, symbol, lo, hi, index_dir))
+            done += 1
+            if len(execs) == 0:
+                continue
+            print("\r", f"[Progress] {done / n_blocks * 100:.1f}%  [Current date] {execs[-1]['exec_date'][:19]}  ", end="")
+
+            buffer.append(pl.DataFrame(execs).with_columns(pl.col("exec_date").str.strptime(pl.Datetime, strict=False)))
+            if buffer_day is None:
+                buffer_day = execs[0]["exec_date"][:10]
+            # ブロックが日付を跨いだら、確定した日をcsv出力する
+            if execs[-1]["exec_date"][:10] != buffer_day:
+                buffer_day = execs[-1]["exec_date"][:10]
+                limit_dt = datetime.strptime(buffer_day, "%Y-%m-%d")
+                buffer = [_bf_write_days(pl.concat(buffer, how="vertical_relaxed"), output_dir, start_dt, end_dt, limit_dt, fmt)]
+
+    if buffer:
+        _bf_write_days(pl.concat(buffer, how="vertical_relaxed"), output_dir, start_dt, end_dt, end_dt, fmt)
+
+
+def bf_get_trades(start_ymd: str, end_ymd: str = None, symbol: str = 'FX_BTC_JPY', output_dir: str = None,
+                  max_workers: int = 1, index_dir: str = None, fmt: str = 'csv') -> None:
     """ example
     bf_get_trades('2021/09/01 00:00:00')
     :param output_dir: str
     :param start_ymd: 2021/09/01 00:00:00     # start date
     :param end_ymd: 2021/09/10 00:00:00    # end date
     :param symbol: FX_BTC_JPY, BTC_JPY, ETH_JPY etc...
+    :param max_workers: 2以上の場合はidブロックを並列に取得します
+    :param index_dir: id索引の保存先(bf_search_id参照)
+    :param fmt: csv, parquet
     """
 
     # 時間を記録する
-    start = cur_time = time.time()
+    start = time.time()
 
     # 保存先を生成
     if output_dir is None:
@@ -191,36 +349,33 @@ def bf_get_trades(start_ymd: str, end_ymd: str = None, symbol: str = 'FX_BTC_JPY
 
     # start_ID検索
     start_ymd = start_ymd.replace('/', '-')
-    start_id, counter = bf_search_id(start_ymd)
+    start_id, _ = bf_search_id(start_ymd, symbol, index_dir=index_dir)
     print(f' [start date] {start_ymd} [target id] {start_id}')
 
     # end_ID検索
     end_ymd = end_ymd.replace('/', '-')
-    end_id, counter1 = bf_search_id(end_ymd)
+    end_id, _ = bf_search_id(end_ymd, symbol, index_dir=index_dir)
     print(f' [end date] {end_ymd} [target id] {end_id}')
 
+    if max_workers > 1:
+        _bf_get_trades_parallel(symbol, start_id, end_id - 1, start_dt, end_dt, output_dir, max_workers, index_dir, fmt)
+        print(f'\nelapsed time: {(time.time() - start) / 60:.2f}min')
+        return
+
     # 初期値
     params = dict(product_code=symbol, count=500)
 
     params["before"] = end_id
-    response = requests.get('https://api.bitflyer.com/v1/getexecutions', params=params).json()
+    response = http_get('bitflyer', 'https://api.bitflyer.com/v1/getexecutions', params=params).json()
     end_base_id = end_id = response[0]['id']
-    counter = counter + counter1 + 1
     cur_dt = end_dt
 
     while start_id <= end_id:
         params["before"] = end_id
-        temp_r = requests.get('https://api.bitflyer.com/v1/getexecutions', params=params).json()
-        counter += 1
+        temp_r = http_get('bitflyer', 'https://api.bitflyer.com/v1/getexecutions', params=params).json()
         if "error_message" in temp_r:
             raise Exception("API制限が掛かっています。300秒待機してから再実行してください。")
-
-        # bitflyerのAPI Limitである300秒に500回までのリクエスト数をクリアさせる条件式
-        if counter >= 500:
-            wait_time = 301 - (time.time() - cur_time)
-            time.sleep(wait_time)
-            cur_time = time.time()
-            counter = 0
+        bf_add_anchors(symbol, temp_r, index_dir)
 
         try:
             end_id = temp_r[-1]['id']
@@ -258,42 +413,36 @@ def bf_get_trades(start_ymd: str, end_ymd: str = None, symbol: str = 'FX_BTC_JPY
                 )
             cur_dt -= timedelta(days=1)
 
-            path = f'{output_dir}/{cur_dt:%Y-%m-%d}.csv'
-            path = path.replace('//', '/')
-            df.write_csv(path)
+            path = table_path(output_dir, f'{cur_dt:%Y-%m-%d}', fmt)
+            write_table(df, path)
             print(f'\n[Output File] --> {path}')
             params["before"] = end_id = df.get_column("id")[0]
-            response = requests.get('https://api.bitflyer.com/v1/getexecutions', params=params).json()
-            counter += 1
+            response = http_get('bitflyer', 'https://api.bitflyer.com/v1/getexecutions', params=params).json()
         else:
             response.extend(temp_r)
 
     print(f'elapsed time: {(time.time() - start) / 60:.2f}min')
 
 
-def bf_trades_to_historical(path: str, price_pl_type: type = pl.Int64, period: str="1s") -> pl.DataFrame:
-    return (
-        pl.scan_csv(path)
-        .with_columns([pl.col("exec_date").str.strptime(pl.Datetime, strict=False).alias("datetime"),
-                       pl.col("price").cast(price_pl_type).alias("price"),
-                       pl.when(pl.col('side') == 'BUY').then(pl.col('size')).otherwise(0).alias('buy_size'),
-                       pl.when(pl.col('side') == 'SELL').then(pl.col('size')).otherwise(0).alias('sell_size')])
-        .groupby_dynamic('datetime', every=period)
-        .agg([
-            pl.col('price').first().alias('open'),
-            pl.col('price').max().alias('high'),
-            pl.col('price').min().alias('low'),
-            pl.col('price').last().alias('close'),
-            pl.col('size').sum().alias('volume'),
-            pl.col('buy_size').sum().alias('buy_vol'),
-            pl.col('sell_size').sum().alias('sell_vol'),
-        ])
-        ).collect()
-
-
-def bf_make_ohlcv(path: str, time_frame, pl_type: pl.DataType=pl.Int64) -> pl.DataFrame:
-    df = make_ohlcv(path, "exec_date", "price", "size", "side", "BUY", "SELL", time_frame, pl_type)
-    start_dt = datetime.combine(df["datetime"][0].date(), datetime.min.time())
-    end_dt = datetime.combine(df["datetime"][-1].date(), datetime.min.time()) + timedelta(days=1, seconds=-1)
-    dt_range = pl.DataFrame({'datetime': pl.datetime_range(start_dt, end_dt, time_frame, eager=True)})
-    return pl_merge(dt_range, df, "datetime")
\ No newline at end of file
+def bf_trades_to_historical(path: str, price_pl_type: type = pl.Int64, period: str="1s",
+                            extra: list = None, streaming: bool = False) -> pl.DataFrame:
+    return (pl_ohlcv(scan_trades(path), TRADE_SCHEMAS['bitflyer'], period, price_pl_type, extra=extra, streaming=streaming)
+            .collect(streaming=streaming))
+
+
+def bf_make_ohlcv(path: str, time_frame, pl_type: pl.DataType=pl.Int64, extra: list = None,
+                  streaming: bool = False) -> pl.DataFrame:
+    df = make_ohlcv(path, "exec_date", "price", "size", "side", "BUY", "SELL", time_frame, pl_type, extra, streaming)
+    return pl_fill_gaps(df, time_frame).collect()
+
+
+def bf_make_ohlcv_multi(path: str, time_frames: list, pl_type: pl.DataType=pl.Int64, extra: list = None,
+                        streaming: bool = False) -> dict:
+    """
+    約定履歴を1回だけ読んで複数の時間軸のohlcvを返します
+    example
+    bf_make_ohlcv_multi('bitflyer/FX_BTC_JPY/trades/2023-01-01.csv', ['1s', '1m', '5m', '1h'])['1m']
+    :return: {time_frame: polars.DataFrame}
+    """
+    return {time_frame: pl_fill_gaps(df, time_frame).collect()
+            for time_frame, df in make_ohlcv_multi(path, 'bitflyer', time_frames, pl_type, extra, streaming).items()}
\ No newline at end of file
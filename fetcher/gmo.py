@@ -1,15 +1,19 @@
+import io
 import os
 import time
-import requests
 import polars as pl
 from traceback import format_exc
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from .time_util import str_to_datetime
-from .util import make_ohlcv, pl_merge
+from .util import make_ohlcv, pl_fill_gaps, _pl_rollup, _pl_with_gap
+from .http_util import http_get, download
+from .io_util import table_path, write_table
 
 
 def gmo_get_historical(start_ymd: str, end_ymd: str = None, symbol: str = 'BTC_JPY', interval: str = '1min',
-                       output_dir: str = None, request_interval: float = 0.2, progress_info: bool = True) -> None:
+                       output_dir: str = None, request_interval: float = 0, progress_info: bool = True,
+                       fmt: str = 'csv') -> None:
     """ example
     gmo_get_historical('2021/09/01', '2021/09/08')
     :param start_ymd: 2021/09/01
@@ -19,6 +23,7 @@ def gmo_get_historical(start_ymd: str, end_ymd: str = None, symbol: str = 'BTC_J
     :param output_dir: csv/hoge/huga/
     :param request_interval: 0
     :param progress_info: False
+    :param fmt: csv, parquet
     :return:
     """
     if output_dir is None:
@@ -41,8 +46,8 @@ def gmo_get_historical(start_ymd: str, end_ymd: str = None, symbol: str = 'BTC_J
     cur_dt = start_dt
     total_count = 0
     while cur_dt <= end_dt:
-        r = requests.get(f'https://api.coin.z.com/public/v1/klines',
-                         params=dict(symbol=symbol, interval=interval, date=cur_dt.strftime('%Y%m%d'))).json()
+        r = http_get('gmo', f'https://api.coin.z.com/public/v1/klines',
+                     params=dict(symbol=symbol, interval=interval, date=cur_dt.strftime('%Y%m%d'))).json()
         df = (
             pl.DataFrame(r["data"])
             .rename({"openTime": "datetime"})
@@ -50,19 +55,79 @@ def gmo_get_historical(start_ymd: str, end_ymd: str = None, symbol: str = 'BTC_J
                 pl.col("datetime").cast(pl.Int64).map(lambda x: x * 1_000).cast(pl.Datetime(time_unit='us'))
             ])
         )
-        df.write_csv(f'{output_dir}/{cur_dt.strftime("%Y-%m-%d")}.csv')
+        if fmt == 'parquet':
+            df = df.with_columns(pl.col(["open", "high", "low", "close", "volume"]).cast(pl.Float64))
+        write_table(df, table_path(output_dir, f'{cur_dt:%Y-%m-%d}', fmt))
         total_count += 1
         if progress_info:
-            print(f'Completed output {cur_dt:%Y%m%d}.csv')
+            print(f'Completed output {cur_dt:%Y%m%d}.{fmt}')
 
         cur_dt += timedelta(days=1)
         if request_interval > 0:
             time.sleep(request_interval)
 
 
+def _gmo_trades_url(symbol: str, dt: datetime) -> str:
+    return f"https://api.coin.z.com/data/trades/{symbol}/{dt:%Y}/{dt:%m}/{dt:%Y%m%d}_{symbol}.csv.gz"
+
+
+def _gmo_run_daily(save_day, start_dt: datetime, end_dt: datetime, output_dir: str,
+                   request_interval: float, max_workers: int, fmt: str = 'csv') -> int:
+    """
+    start_dt -> end_dt の日付ごとに save_day(cur_dt, csv_path) を実行します
+    出力済みのファイルはスキップし、max_workers > 1 の場合はスレッドプールで並列に処理します
+    :return: 出力したファイル数
+    """
+    def run(cur_dt, csv_path):
+        try:
+            return save_day(cur_dt, csv_path)
+        finally:
+            if request_interval > 0:
+                time.sleep(request_interval)
+
+    # csv存在チェック
+    days = []
+    cur_dt = start_dt
+    while cur_dt <= end_dt:
+        csv_path = table_path(output_dir, f"{cur_dt:%Y}-{cur_dt:%m}-{cur_dt:%d}", fmt)
+        if not os.path.isfile(csv_path):
+            days.append((cur_dt, csv_path))
+        cur_dt += timedelta(days=1)
+
+    if max_workers <= 1:
+        return sum(run(cur_dt, csv_path) for cur_dt, csv_path in days)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(run, cur_dt, csv_path) for cur_dt, csv_path in days]
+        return sum(future.result() for future in futures)
+
+
 def gmo_get_trades(start_ymd: str, end_ymd: str = None, symbol: str = 'BTC_JPY',
-                        output_dir: str = None, request_interval: float = 0.01,
-                        progress_info: bool = True) -> None:
+                        output_dir: str = None, request_interval: float = 0,
+                        progress_info: bool = True, max_workers: int = 1, fmt: str = 'csv') -> None:
+    """
+    example
+    gmo_get_trades('2023/01/01', '2023/12/31', max_workers=8)
+    :param max_workers: 同時にダウンロードする日数. 1の場合は1日ずつ処理します
+    :param fmt: csv, parquet
+    """
+
+    def save_trades(cur_dt, csv_path):
+        url = _gmo_trades_url(symbol, cur_dt)
+        try:
+            df = pl.read_csv(io.BytesIO(download('gmo', url)), try_parse_dates=fmt == 'parquet')
+        except Exception as e:
+            print(f"{e}")
+            df = None
+
+        if df is None or len(df) < 1:
+            print(f"Failed to read the trading file." + url)
+            return False
+
+        write_table(df, csv_path)
+        if progress_info:
+            print(f'Completed output {csv_path}')
+        return True
 
     try:
         # 出力ディレクトリ設定
@@ -83,39 +148,7 @@ def gmo_get_trades(start_ymd: str, end_ymd: str = None, symbol: str = 'BTC_JPY',
         print(f'output dir: {output_dir}  save term: {start_dt:%Y/%m/%d} -> {end_dt:%Y/%m/%d}')
 
         # 日別にcsv出力
-        cur_dt = start_dt
-        total_count = 0
-        while cur_dt <= end_dt:
-            # csvパス
-            csv_path = os.path.join(output_dir, f"{cur_dt:%Y}-{cur_dt:%m}-{cur_dt:%d}.csv")
-            # csv存在チェック
-            if os.path.isfile(csv_path):
-                cur_dt += timedelta(days=1)
-                continue
-
-            try:
-                df = pl.read_csv(f"https://api.coin.z.com/data/trades/{symbol}/{cur_dt:%Y}/{cur_dt:%m}/{cur_dt:%Y%m%d}_{symbol}.csv.gz")
-
-            except Exception as e:
-                print(f"{e}")
-                df = None
-
-            if df is None or len(df) < 1:
-                print(f"Failed to read the trading file." +
-                      f"https://api.coin.z.com/data/trades/{symbol}/{cur_dt:%Y}/{cur_dt:%m}/{cur_dt:%Y%m%d}_{symbol}.csv.gz")
-                cur_dt += timedelta(days=1)
-                if request_interval > 0:
-                    time.sleep(request_interval)
-                continue
-
-            df.write_csv(csv_path)
-            total_count += 1
-            if progress_info:
-                print(f'Completed output {csv_path}.csv')
-
-            cur_dt += timedelta(days=1)
-            if request_interval > 0:
-                time.sleep(request_interval)
+        total_count = _gmo_run_daily(save_trades, start_dt, end_dt, output_dir, request_interval, max_workers, fmt)
 
         print(f'Total output files: {total_count}')
 
@@ -126,8 +159,34 @@ def gmo_get_trades(start_ymd: str, end_ymd: str = None, symbol: str = 'BTC_JPY',
 
 def gmo_trades_to_historical(start_ymd: str, end_ymd: str = None, symbol: str = 'BTC_JPY',
                             time_frame: str = '1s', pl_type: pl.DataType = pl.Float64,
-                            output_dir: str = None, request_interval: float = 0.01,
-                            progress_info: bool = True) -> None:
+                            output_dir: str = None, request_interval: float = 0,
+                            progress_info: bool = True, max_workers: int = 1, fmt: str = 'csv',
+                            cache: bool = True, extra: list = None) -> None:
+    """
+    example
+    gmo_trades_to_historical('2023/01/01', '2023/12/31', max_workers=8)
+    :param max_workers: 同時にダウンロード・集計する日数. 1の場合は1日ずつ処理します
+    :param fmt: csv, parquet
+    :param cache: ダウンロードした約定履歴をキャッシュします(http_util.set_cache参照)
+    :param extra: 追加で集計する列(util.EXTRA_AGGS参照)
+    """
+
+    def save_ohlcv(cur_dt, csv_path):
+        url = _gmo_trades_url(symbol, cur_dt)
+        try:
+            df = make_ohlcv(io.BytesIO(download('gmo', url, cache)), "timestamp", "price", "size", "side", "BUY", "SELL", time_frame, pl_type, extra)
+        except Exception as e:
+            print(f"{e}")
+            df = None
+
+        if df is None or len(df) < 1:
+            print(f"Failed to read the trading file.\n" + url)
+            return False
+
+        write_table(df, csv_path)
+        if progress_info:
+            print(f'Completed output {csv_path}')
+        return True
 
     try:
         # 出力ディレクトリ設定
@@ -150,39 +209,7 @@ def gmo_trades_to_historical(start_ymd: str, end_ymd: str = None, symbol: str =
         print(f'output dir: {output_dir}  save term: {start_dt:%Y/%m/%d} -> {end_dt:%Y/%m/%d}')
 
         # 日別にcsv出力
-        cur_dt = start_dt
-        total_count = 0
-        while cur_dt <= end_dt:
-            # csvパス
-            csv_path = os.path.join(output_dir, f"{cur_dt:%Y}-{cur_dt:%m}-{cur_dt:%d}.csv")
-            # csv存在チェック
-            if os.path.isfile(csv_path):
-                cur_dt += timedelta(days=1)
-                continue
-
-            try:
-                df = make_ohlcv(f"https://api.coin.z.com/data/trades/{symbol}/{cur_dt:%Y}/{cur_dt:%m}/{cur_dt:%Y%m%d}_{symbol}.csv.gz",
-                                "timestamp", "price", "size", "side", "BUY", "SELL", time_frame, pl_type)
-            except Exception as e:
-                print(f"{e}")
-                df = None
-
-            if df is None or len(df) < 1:
-                print(f"Failed to read the trading file.\n" +
-                      f"https://api.coin.z.com/data/trades/{symbol}/{cur_dt:%Y}/{cur_dt:%m}/{cur_dt:%Y%m%d}_{symbol}.csv.gz")
-                cur_dt += timedelta(days=1)
-                if request_interval > 0:
-                    time.sleep(request_interval)
-                continue
-
-            df.write_csv(csv_path)
-            total_count += 1
-            if progress_info:
-                print(f'Completed output {csv_path}.csv')
-
-            cur_dt += timedelta(days=1)
-            if request_interval > 0:
-                time.sleep(request_interval)
+        total_count = _gmo_run_daily(save_ohlcv, start_dt, end_dt, output_dir, request_interval, max_workers, fmt)
 
         print(f'Total output files: {total_count}')
 
@@ -192,33 +219,82 @@ def gmo_trades_to_historical(start_ymd: str, end_ymd: str = None, symbol: str =
 
 
 def gmo_make_ohlcv(date: str, symbol: str = 'BTC_JPY',
-                   time_frame: str = '1s', pl_type: pl.DataType = pl.Float64,):
+                   time_frame: str = '1s', pl_type: pl.DataType = pl.Float64, cache: bool = True,
+                   extra: list = None):
     """
     example
     print(gmo_make_ohlcv("2023-07-20", pl_type=pl.Int32))
+    :param cache: ダウンロードした約定履歴をキャッシュします(http_util.set_cache参照)
+    :param extra: 追加で集計する列(util.EXTRA_AGGS参照)
     """
     # 取得期間
     dt = str_to_datetime(date)
     after = dt + timedelta(days=1)
 
-    df1 = make_ohlcv(f"https://api.coin.z.com/data/trades/{symbol}/{dt:%Y}/{dt:%m}/{dt:%Y%m%d}_{symbol}.csv.gz",
-                            "timestamp", "price", "size", "side", "BUY", "SELL", time_frame, pl_type)
-    df2 = make_ohlcv(f"https://api.coin.z.com/data/trades/{symbol}/{after:%Y}/{after:%m}/{after:%Y%m%d}_{symbol}.csv.gz",
-                            "timestamp", "price", "size", "side", "BUY", "SELL", time_frame, pl_type)
+    df1 = make_ohlcv(io.BytesIO(download('gmo', _gmo_trades_url(symbol, dt), cache)),
+                            "timestamp", "price", "size", "side", "BUY", "SELL", time_frame, pl_type, extra)
+    df2 = make_ohlcv(io.BytesIO(download('gmo', _gmo_trades_url(symbol, after), cache)),
+                            "timestamp", "price", "size", "side", "BUY", "SELL", time_frame, pl_type, extra)
     df = (
         pl.concat([df1, df2])
         .lazy()
         .filter((pl.col("datetime").ge(dt)) & (pl.col("datetime").lt(after)))
         .collect()
         )
-    start_dt = datetime.combine(df["datetime"][0].date(), datetime.min.time())
-    end_dt = datetime.combine(df["datetime"][-1].date(), datetime.min.time()) + timedelta(days=1, seconds=-1)
-    dt_range = pl.DataFrame({'datetime': pl.datetime_range(start_dt, end_dt, time_frame, eager=True)})
-    return pl_merge(dt_range, df, "datetime")
+    return pl_fill_gaps(df, time_frame).collect()
+
+
+def gmo_make_ohlcv_range(start_ymd: str, end_ymd: str, symbol: str = 'BTC_JPY',
+                         time_frame: str = '1s', pl_type: pl.DataType = pl.Float64,
+                         max_workers: int = 1, cache: bool = True, extra: list = None,
+                         sparse: bool = False) -> pl.DataFrame:
+    """
+    start_ymd -> end_ymd の全期間のohlcvを欠損を埋めて返します
+    gmo_make_ohlcvを日毎に呼ぶと翌日分も毎回ダウンロードしますが、こちらは各日のファイルを1回だけ読みます
+    日付を跨ぐ足(ファイルの境界にある足)は前後のファイルの集計を合成します
+    example
+    print(gmo_make_ohlcv_range("2023-07-01", "2023-07-31", time_frame="1m"))
+    :param max_workers: 同時にダウンロード・集計する日数
+    :param cache: ダウンロードした約定履歴をキャッシュします(http_util.set_cache参照)
+    :param extra: 追加で集計する列(util.EXTRA_AGGS参照)
+    :param sparse: Trueの場合は欠損の先頭の足だけを追加します(util.pl_fill_gaps参照)
+    """
+    start_dt = str_to_datetime(start_ymd)
+    end_dt = str_to_datetime(end_ymd) + timedelta(days=1)
+    if start_dt >= end_dt:
+        raise ValueError(f'end_ymd{end_ymd} should be after start_ymd{start_ymd}.')
+
+    def load(cur_dt):
+        return make_ohlcv(io.BytesIO(download('gmo', _gmo_trades_url(symbol, cur_dt), cache)),
+                          "timestamp", "price", "size", "side", "BUY", "SELL", time_frame, pl_type, extra)
+
+    # end_ymdの翌日のファイルまでに期間内の約定が含まれる
+    days = [start_dt + timedelta(days=i) for i in range((end_dt - start_dt).days + 1)]
+    if max_workers <= 1:
+        frames = [load(cur_dt) for cur_dt in days]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            frames = list(executor.map(load, days))
+
+    df = pl.concat(frames)
+    if getattr(df.schema["datetime"], "time_zone", None) is not None:
+        # 末尾のZでUTCとして読まれた場合はnaiveなUTCに揃える
+        df = df.with_columns(pl.col("datetime").dt.convert_time_zone("UTC").dt.replace_time_zone(None))
+
+    # ファイルの境界で分かれた足を合成する(ファイルは日付順に並んでいるのでfirst/lastはそのまま使える)
+    lf = (
+        _pl_with_gap(df).lazy()
+        .filter((pl.col("datetime").ge(start_dt)) & (pl.col("datetime").lt(end_dt)))
+        .group_by("datetime", maintain_order=True)
+        .agg(_pl_rollup(df.columns))
+        .sort("datetime")
+    )
+    return pl_fill_gaps(lf, time_frame, start_dt, end_dt - timedelta(seconds=1), sparse).collect()
 
 
 def gmo_FX_get_historical(start_ymd: str, end_ymd: str = None, symbol: str = 'USD_JPY', interval: str = '1min',
-                       output_dir: str = None, request_interval: float = 0.2, progress_info: bool = True) -> None:
+                       output_dir: str = None, request_interval: float = 0, progress_info: bool = True,
+                       fmt: str = 'csv') -> None:
     """ example
     gmo_get_historical('2021/09/01', '2021/09/08')
     :param start_ymd: 2021/09/01
@@ -228,6 +304,7 @@ def gmo_FX_get_historical(start_ymd: str, end_ymd: str = None, symbol: str = 'US
     :param output_dir: csv/hoge/huga/
     :param request_interval: 0
     :param progress_info: False
+    :param fmt: csv, parquet
     :return:
     """
     if output_dir is None:
@@ -250,8 +327,8 @@ def gmo_FX_get_historical(start_ymd: str, end_ymd: str = None, symbol: str = 'US
     cur_dt = start_dt
     total_count = 0
     while cur_dt <= end_dt:
-        r = requests.get(f'https://forex-api.coin.z.com/public/v1/klines',
-                         params=dict(symbol=symbol, priceType="ASK", interval=interval, date=cur_dt.strftime('%Y%m%d'))).json()
+        r = http_get('gmo', f'https://forex-api.coin.z.com/public/v1/klines',
+                     params=dict(symbol=symbol, priceType="ASK", interval=interval, date=cur_dt.strftime('%Y%m%d'))).json()
         df = (
             pl.DataFrame(r["data"])
             .rename({"openTime": "datetime"})
@@ -259,10 +336,12 @@ def gmo_FX_get_historical(start_ymd: str, end_ymd: str = None, symbol: str = 'US
                 pl.col("datetime").cast(pl.Int64).map(lambda x: x * 1_000).cast(pl.Datetime(time_unit='us'))
             ])
         )
-        df.write_csv(f'{output_dir}/{cur_dt.strftime("%Y-%m-%d")}.csv')
+        if fmt == 'parquet':
+            df = df.with_columns(pl.col(["open", "high", "low", "close", "volume"]).cast(pl.Float64))
+        write_table(df, table_path(output_dir, f'{cur_dt:%Y-%m-%d}', fmt))
         total_count += 1
         if progress_info:
-            print(f'Completed output {cur_dt:%Y%m%d}.csv')
+            print(f'Completed output {cur_dt:%Y%m%d}.{fmt}')
 
         cur_dt += timedelta(days=1)
         if request_interval > 0:
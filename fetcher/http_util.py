@@ -0,0 +1,220 @@
+import os
+import gzip
+import time
+import hashlib
+import tempfile
+import threading
+import requests
+from contextlib import contextmanager
+from requests.adapters import HTTPAdapter
+
+
+# 取引所ごとの公開レート制限 (リクエスト数(weight), 秒, バースト)
+RATE_LIMITS = {
+    'binance': (2400, 60, 100),         # fapi: 2400 weight/分 (aggTradesは1回20 weight)
+    'binance_data': (1000, 300, 10),    # futures/data: 1000回/5分
+    'bitflyer': (500, 300, 10),         # 500回/5分
+    'bitfinex': (30, 60, 1),            # trades/hist: 30回/分
+    'bitbank': (10, 1, 1),
+    'gmo': (6, 1, 1),
+    'bybit': (10, 1, 1),
+}
+
+# 日別アーカイブのダウンロードキャッシュ
+CACHE_DIR = os.environ.get('FETCHER_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'fetcher'))
+CACHE_MAX_BYTES = int(os.environ.get('FETCHER_CACHE_MAX_BYTES', 10 * 1024 ** 3))
+
+_buckets = {}
+_sessions = {}
+_lock = threading.Lock()
+
+
+class TokenBucket:
+    """
+    スレッドセーフなトークンバケット
+    バースト分を差し引いた速度で補充するため、任意のperiod秒間でcallsを超えません
+    """
+    def __init__(self, calls: int, period: float, burst: int = 1):
+        if not 0 < burst < calls:
+            raise ValueError(f'burst{burst} should be between 0 and calls{calls}.')
+        self.capacity = burst
+        self.rate = (calls - burst) / period
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: int = 1) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                # バーストより大きいweightは残量が満タンになれば通す(負債として繰り越す)
+                if self.tokens >= min(tokens, self.capacity):
+                    self.tokens -= tokens
+                    return
+                wait = (min(tokens, self.capacity) - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def set_rate_limit(exchange: str, calls: int, period: float, burst: int = 1) -> None:
+    """
+    レート制限を上書きします
+    example
+    set_rate_limit('bitflyer', 250, 300)
+    """
+    with _lock:
+        RATE_LIMITS[exchange] = (calls, period, burst)
+        _buckets[exchange] = TokenBucket(calls, period, burst)
+
+
+def get_bucket(exchange: str) -> TokenBucket:
+    with _lock:
+        if exchange not in _buckets:
+            _buckets[exchange] = TokenBucket(*RATE_LIMITS[exchange])
+        return _buckets[exchange]
+
+
+def get_session(exchange: str) -> requests.Session:
+    """
+    取引所ごとにkeep-aliveのコネクションプールを共有します
+    """
+    with _lock:
+        if exchange not in _sessions:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _sessions[exchange] = session
+        return _sessions[exchange]
+
+
+def http_get(exchange: str, url: str, params: dict = None, weight: int = 1, **kwargs) -> requests.Response:
+    """
+    レート制限を守りつつ共有セッションでGETします
+    :param exchange: RATE_LIMITSのキー
+    :param weight: リクエスト1回で消費するweight
+    """
+    get_bucket(exchange).acquire(weight)
+    return get_session(exchange).get(url, params=params, **kwargs)
+
+
+def set_cache(cache_dir: str = None, max_bytes: int = None) -> None:
+    """
+    ダウンロードキャッシュの保存先と上限サイズを変更します
+    """
+    global CACHE_DIR, CACHE_MAX_BYTES
+    if cache_dir is not None:
+        CACHE_DIR = cache_dir
+    if max_bytes is not None:
+        CACHE_MAX_BYTES = max_bytes
+
+
+@contextmanager
+def _cache_lock():
+    """
+    複数プロセスからの追い出しが重ならないようにロックします(fcntlが無い環境では何もしません)
+    """
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(os.path.join(CACHE_DIR, '.lock'), 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _atomic_write(path: str, data: bytes) -> None:
+    # 同じディレクトリの一時ファイルに書いてからos.replaceで置き換える
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _cache_get(url: str):
+    """
+    URLのキャッシュを返します. 中身のsha256とサイズが記録と違う場合は無効として扱います
+    """
+    ref = os.path.join(CACHE_DIR, 'refs', hashlib.sha256(url.encode()).hexdigest())
+    try:
+        with open(ref) as f:
+            digest, size = f.read().split()
+        obj = os.path.join(CACHE_DIR, 'objects', digest)
+        with open(obj, 'rb') as f:
+            data = f.read()
+    except (OSError, ValueError):
+        return None
+    if len(data) != int(size) or hashlib.sha256(data).hexdigest() != digest:
+        return None
+    # 最終利用時刻を更新(LRU)
+    try:
+        os.utime(obj)
+        os.utime(ref)
+    except OSError:
+        pass
+    return data
+
+
+def _cache_put(url: str, data: bytes) -> None:
+    digest = hashlib.sha256(data).hexdigest()
+    for name in ('objects', 'refs'):
+        os.makedirs(os.path.join(CACHE_DIR, name), exist_ok=True)
+    obj = os.path.join(CACHE_DIR, 'objects', digest)
+    if not os.path.isfile(obj):
+        _atomic_write(obj, data)
+    _atomic_write(os.path.join(CACHE_DIR, 'refs', hashlib.sha256(url.encode()).hexdigest()),
+                  f'{digest} {len(data)}'.encode())
+    _cache_evict()
+
+
+def _cache_evict() -> None:
+    """
+    合計サイズがCACHE_MAX_BYTESを超えたら最終利用時刻の古い順に削除します
+    """
+    with _cache_lock():
+        objects = []
+        for entry in os.scandir(os.path.join(CACHE_DIR, 'objects')):
+            if entry.name.startswith('.tmp-'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            objects.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in objects)
+        for _, size, path in sorted(objects):
+            if total <= CACHE_MAX_BYTES:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def download(exchange: str, url: str, cache: bool = False) -> bytes:
+    """
+    ファイルをダウンロードします. .gzは展開して返します
+    :param cache: Trueの場合はCACHE_DIRのキャッシュを使います. 内容が変わらない過去分のアーカイブ向けです
+    """
+    data = _cache_get(url) if cache else None
+    if data is None:
+        r = http_get(exchange, url)
+        r.raise_for_status()
+        data = r.content
+        if cache:
+            _cache_put(url, data)
+    if url.endswith('.gz'):
+        return gzip.decompress(data)
+    return data
@@ -0,0 +1,317 @@
+import os
+import csv
+import glob
+import pandas as pd
+import polars as pl
+import pyarrow as pa
+import pyarrow.parquet as pq
+from datetime import datetime, timedelta, timezone
+
+
+FORMATS = ('csv', 'parquet')
+# append_tableのパートファイルがこの数を超えたら本体にまとめる
+PARQUET_MAX_PARTS = 64
+
+
+def table_path(output_dir: str, name: str, fmt: str = 'csv') -> str:
+    """
+    {output_dir}/{name}.{fmt} を返します
+    出力先は{取引所}/{銘柄}/.../{日付}のようにパーティション分けされています
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f'fmt{fmt} should be one of {FORMATS}.')
+    return f'{output_dir}/{name}.{fmt}'.replace('//', '/')
+
+
+def table_format(path: str) -> str:
+    return 'parquet' if str(path).endswith('.parquet') else 'csv'
+
+
+def parquet_parts(path: str) -> list:
+    """
+    parquetの本体とappend_tableで追記したパートファイル({stem}.part-000001.parquet ...)を順番に返します
+    """
+    stem = str(path)[:-len('.parquet')]
+    return [path] + sorted(glob.glob(f'{glob.escape(stem)}.part-*.parquet'))
+
+
+def write_table(df, path: str) -> None:
+    """
+    拡張子に応じてcsvかparquet(zstd圧縮)で保存します
+    pandas.DataFrameは名前付きのindexを列として保存します
+    """
+    if table_format(path) == 'csv':
+        if isinstance(df, pd.DataFrame):
+            df.to_csv(path)
+        else:
+            df.write_csv(path)
+        return
+
+    if isinstance(df, pd.DataFrame):
+        df = pl.from_pandas(df.reset_index() if df.index.name is not None else df)
+    df.write_parquet(path, compression='zstd', statistics=True)
+    # 上書きしたので古いパートファイルは消す
+    for part in parquet_parts(path)[1:]:
+        os.remove(part)
+
+
+def read_table(path: str) -> pl.DataFrame:
+    if table_format(path) == 'parquet':
+        return pl.concat([pl.read_parquet(part) for part in parquet_parts(path)])
+    return pl.read_csv(path)
+
+
+def scan_table(path: str) -> pl.LazyFrame:
+    if table_format(path) == 'parquet':
+        return pl.concat([pl.scan_parquet(part) for part in parquet_parts(path)])
+    return pl.scan_csv(path)
+
+
+def read_pd_table(path: str, index_col: str) -> pd.DataFrame:
+    """
+    差分更新用にpandas.DataFrame(index_colをDatetimeIndex)で読み込みます
+    """
+    if table_format(path) == 'parquet':
+        return pd.concat([pd.read_parquet(part) for part in parquet_parts(path)]).set_index(index_col)
+    return pd.read_csv(path, index_col=index_col, parse_dates=True)
+
+
+def pl_datetime(lf: pl.LazyFrame, date_column_name: str) -> pl.Expr:
+    """
+    文字列(csv)ならパースし、Datetime(parquet)ならそのまま返します
+    """
+    if lf.schema[date_column_name] == pl.Utf8:
+        return pl.col(date_column_name).str.strptime(pl.Datetime, strict=False)
+    return pl.col(date_column_name)
+
+
+# fetcherの出力先 (ディレクトリ, 時刻列, 時刻の型)
+TRADE_LAYOUTS = {
+    'bitflyer': ('bitflyer/{symbol}/trades', 'exec_date', 'datetime'),
+    'binance': ('binance/trades/{symbol}', 'T', 'ms'),
+    'gmo': ('gmo/{symbol}/trades_only', 'timestamp', 'datetime'),
+    'bitbank': ('bitbank/{symbol}/trades', 'executed_at', 'ms'),
+    'bitfinex': ('bitfinex/{symbol}/trades', 'datetime', 'datetime'),
+}
+OHLCV_LAYOUTS = {
+    'gmo': ('gmo/{symbol}/trades', 'datetime', 'datetime'),
+    'gmo_historical': ('gmo/{symbol}/ohlcv/{interval}', 'datetime', 'datetime'),
+    'bitbank': ('bitbank/{symbol}/ohlcv', 'datetime', 'datetime'),
+}
+
+
+def _time_bound(value, time_type: str) -> datetime:
+    # csvの文字列, parquetの統計情報の値をnaiveなUTCのdatetimeにする
+    if time_type == 'ms':
+        return datetime(1970, 1, 1) + timedelta(milliseconds=int(value))
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is not None:
+        ts = ts.tz_convert('UTC').tz_localize(None)
+    return ts.to_pydatetime()
+
+
+def _time_range(path: str, time_col: str, time_type: str):
+    """
+    ファイルの最初と最後の時刻を返します. parquetはフッターの統計情報, csvは先頭と末尾の1行だけを読みます
+    読めない場合はNoneを返します
+    """
+    try:
+        if table_format(path) == 'parquet':
+            values = []
+            for part in parquet_parts(path):
+                metadata = pq.ParquetFile(part).metadata
+                i = metadata.schema.to_arrow_schema().get_field_index(time_col)
+                if i < 0:
+                    return None
+                for rg in range(metadata.num_row_groups):
+                    stats = metadata.row_group(rg).column(i).statistics
+                    if stats is None or not stats.has_min_max:
+                        return None
+                    values += [stats.min, stats.max]
+        else:
+            with open(path, newline='') as f:
+                reader = csv.reader(f)
+                i = next(reader).index(time_col)
+                values = [next(reader)[i], next(csv.reader([_tail_line(path)]))[i]]
+        values = [_time_bound(value, time_type) for value in values]
+    except (OSError, ValueError, TypeError, StopIteration, IndexError):
+        return None
+    return (min(values), max(values)) if values else None
+
+
+def _partitions(directory: str, start: datetime, end: datetime, time_col: str, time_type: str) -> list:
+    """
+    start~endのデータを含むファイルを返します. 同じ日付はparquetを優先します
+    ファイル名の日付の前後1日(gmoのようにUTCと日付がずれるファイル)はそのまま含めます
+    それ以外のファイルも開始日(binance)や終了日(bitfinex)の名前で複数日を保存している場合があるので、
+    先頭と末尾の時刻を読んで範囲に掛かるか確認します
+    """
+    files = {}
+    for name in sorted(os.listdir(directory)):
+        stem, ext = os.path.splitext(name)
+        if ext not in ('.csv', '.parquet'):
+            continue
+        try:
+            datetime.strptime(stem, '%Y-%m-%d')
+        except ValueError:
+            continue
+        if stem not in files or ext == '.parquet':
+            files[stem] = os.path.join(directory, name)
+
+    paths = []
+    for stem in sorted(files):
+        day = datetime.strptime(stem, '%Y-%m-%d')
+        if (start - timedelta(days=1)).date() <= day.date() <= (end + timedelta(days=1)).date():
+            paths.append(files[stem])
+            continue
+        bounds = _time_range(files[stem], time_col, time_type)
+        if bounds is None or (bounds[0] < end and bounds[1] >= start):
+            paths.append(files[stem])
+    return paths
+
+
+def _scan_range(layout: tuple, start: datetime, end: datetime, columns: list, root: str,
+                **fmt_args) -> pl.LazyFrame:
+    template, time_col, time_type = layout
+    directory = os.path.join(root, template.format(**fmt_args))
+    paths = _partitions(directory, start, end, time_col, time_type) if os.path.isdir(directory) else []
+    if not paths:
+        raise FileNotFoundError(f'no files found in {directory} for {start} -> {end}')
+
+    frames = []
+    for path in paths:
+        lf = scan_table(path)
+        dtype = lf.schema[time_col]
+        if time_type == 'ms':
+            # 整数のまま比較してparquetの統計情報で読み飛ばせるようにする
+            lf = (lf.filter(pl.col(time_col).ge(int(start.replace(tzinfo=timezone.utc).timestamp() * 1000))
+                            & pl.col(time_col).lt(int(end.replace(tzinfo=timezone.utc).timestamp() * 1000)))
+                  .with_columns((pl.col(time_col) * 1_000).cast(pl.Datetime(time_unit='us')).alias('datetime')))
+        elif dtype == pl.Utf8:
+            # 末尾のZ(UTC)は外してnaiveなUTCに揃える
+            dt = pl.col(time_col).str.replace(r'Z$', '').str.strptime(pl.Datetime, strict=False)
+            lf = lf.with_columns(dt.alias('datetime')).filter(pl.col('datetime').ge(start) & pl.col('datetime').lt(end))
+        else:
+            tz = getattr(dtype, 'time_zone', None)
+            lo, hi = pl.lit(start), pl.lit(end)
+            dt = pl.col(time_col)
+            if tz is not None:
+                lo, hi = lo.dt.replace_time_zone('UTC'), hi.dt.replace_time_zone('UTC')
+                dt = dt.dt.convert_time_zone('UTC').dt.replace_time_zone(None)
+            lf = lf.filter(pl.col(time_col).ge(lo) & pl.col(time_col).lt(hi)).with_columns(dt.alias('datetime'))
+        if columns is not None:
+            lf = lf.select(['datetime'] + [col for col in columns if col != 'datetime'])
+        frames.append(lf)
+    return pl.concat(frames, how='vertical_relaxed')
+
+
+def load_trades(exchange: str, symbol: str, start: datetime, end: datetime, columns: list = None,
+                root: str = '.', lazy: bool = False):
+    """
+    fetcherで保存した約定履歴からstart <= datetime < end(UTC)の範囲を読み込みます
+    ファイル名の日付で対象ファイルを絞り、時刻の条件と列の選択はpolarsのscanに渡します
+    example
+    load_trades('bitflyer', 'FX_BTC_JPY', datetime(2023, 1, 5, 3), datetime(2023, 1, 9, 12), ['price', 'size'])
+    :param exchange: TRADE_LAYOUTSのキー
+    :param columns: 読み込む列. datetime列は常に先頭に追加されます
+    :param root: 出力先のルートディレクトリ
+    :param lazy: TrueならLazyFrameを返します
+    """
+    lf = _scan_range(TRADE_LAYOUTS[exchange], start, end, columns, root, symbol=symbol)
+    return lf if lazy else lf.collect()
+
+
+def load_ohlcv(exchange: str, symbol: str, start: datetime, end: datetime, columns: list = None,
+               root: str = '.', interval: str = None, lazy: bool = False):
+    """
+    fetcherで保存したohlcvからstart <= datetime < end(UTC)の範囲を読み込みます
+    :param exchange: OHLCV_LAYOUTSのキー
+    :param interval: gmo_historicalの足(1min等)
+    """
+    lf = _scan_range(OHLCV_LAYOUTS[exchange], start, end, columns, root, symbol=symbol, interval=interval)
+    return lf if lazy else lf.collect()
+
+
+def _tail_line(path: str, block_size: int = 4096) -> str:
+    """
+    ファイル末尾から最後の1行だけを読みます
+    """
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        buf = b''
+        while pos > 0:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            buf = f.read(step) + buf
+            lines = buf.rstrip(b'\r\n').split(b'\n')
+            if len(lines) > 1 or pos == 0:
+                return lines[-1].decode().rstrip('\r')
+    return ''
+
+
+def _header(path: str) -> list:
+    with open(path, newline='') as f:
+        return next(csv.reader(f))
+
+
+def last_timestamp(path: str, col: str) -> pd.Timestamp:
+    """
+    時刻順に追記されたファイルの最終時刻を返します
+    csvは末尾の1行, parquetは最後のパートファイル(無ければ本体)のフッターの統計情報だけを読みます
+    """
+    if table_format(path) == 'parquet':
+        # append_tableは新しい行だけを追記するので最後のファイルに最終時刻がある
+        metadata = pq.ParquetFile(parquet_parts(path)[-1]).metadata
+        i = metadata.schema.to_arrow_schema().get_field_index(col)
+        return pd.Timestamp(max(metadata.row_group(rg).column(i).statistics.max
+                                for rg in range(metadata.num_row_groups)))
+    row = next(csv.reader([_tail_line(path)]))
+    return pd.Timestamp(row[_header(path).index(col)])
+
+
+def append_table(df: pd.DataFrame, path: str) -> None:
+    """
+    既存ファイルに新しい行だけを追記します
+    csvは既存の列順でそのまま追記し、parquetは新しい行だけを本体と同じスキーマのパートファイルに書き出します
+    パートファイルはread_table, scan_table, last_timestampが本体と合わせて読み、
+    PARQUET_MAX_PARTSを超えたらcompact_tableで本体にまとめます
+    """
+    if len(df) == 0:
+        return
+    if df.index.name is not None:
+        df = df.reset_index()
+
+    if table_format(path) == 'csv':
+        df[_header(path)].to_csv(path, mode='a', header=False, index=False)
+        return
+
+    schema = pq.read_schema(path)
+    table = pa.Table.from_pandas(df, preserve_index=False).select(schema.names).cast(schema)
+    part = f'{path[:-len(".parquet")]}.part-{len(parquet_parts(path)):06d}.parquet'
+    # 書き込み途中のファイルが読まれないように一時ファイルからos.replaceする
+    tmp = f'{part}.tmp'
+    pq.write_table(table, tmp, compression='zstd')
+    os.replace(tmp, part)
+    if len(parquet_parts(path)) > PARQUET_MAX_PARTS + 1:
+        compact_table(path)
+
+
+def compact_table(path: str) -> None:
+    """
+    parquetの本体とパートファイルをrow groupごとに書き写して1つのファイルにまとめます
+    """
+    parts = parquet_parts(path)
+    if len(parts) == 1:
+        return
+    schema = pq.read_schema(path)
+    tmp = f'{path}.tmp'
+    with pq.ParquetWriter(tmp, schema, compression='zstd') as writer:
+        for part in parts:
+            src = pq.ParquetFile(part)
+            for rg in range(src.num_row_groups):
+                writer.write_table(src.read_row_group(rg))
+    os.replace(tmp, path)
+    for part in parts[1:]:
+        os.remove(part)
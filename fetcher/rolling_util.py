@@ -0,0 +1,196 @@
+import numpy as np
+
+
+def _as_2d(arr: np.ndarray) -> np.ndarray:
+    """
+    1次元配列は(n, 1)のビューにして、行方向(axis=0)を時系列として扱います
+    """
+    arr = np.asarray(arr)
+    if arr.ndim == 1:
+        return arr[:, None]
+    if arr.ndim != 2:
+        raise ValueError(f'arr.ndim{arr.ndim} should be 1 or 2.')
+    return arr
+
+
+def _output(arr: np.ndarray, out: np.ndarray) -> np.ndarray:
+    if out is None:
+        return np.empty(arr.shape, dtype=np.float64)
+    if out.shape != arr.shape:
+        raise ValueError(f'out.shape{out.shape} should be {arr.shape}.')
+    return out
+
+
+def _window_sums(x: np.ndarray, window: int, power: int = 1):
+    """
+    NaNを除いた窓内の合計と有効な値の数を累積和の差で求めます
+    先頭のwindow-1行は途中までの窓(先頭からその行まで)の値になります
+    """
+    valid = ~np.isnan(x)
+    c = np.zeros((x.shape[0] + 1, x.shape[1]))
+    np.cumsum(np.where(valid, x, 0) ** power, axis=0, out=c[1:])
+    n = np.zeros((x.shape[0] + 1, x.shape[1]))
+    np.cumsum(valid, axis=0, out=n[1:])
+    lo = np.maximum(np.arange(1, x.shape[0] + 1) - window, 0)
+    return c[1:] - c[lo], n[1:] - n[lo]
+
+
+def np_rolling_sum(arr: np.ndarray, window: int, min_periods: int = None, out: np.ndarray = None) -> np.ndarray:
+    """
+    移動合計を計算します. NaNは無視し、有効な値がmin_periods(デフォルトはwindow)未満の位置はNaNになります
+    2次元配列は列ごとに計算します
+    :param out: 結果を書き込む配列
+    """
+    x = _as_2d(arr).astype(np.float64, copy=False)
+    result = _output(np.asarray(arr), out)
+    r = _as_2d(result)
+    s, k = _window_sums(x, window)
+    r[:] = np.where(k >= (window if min_periods is None else min_periods), s, np.nan)
+    return result
+
+
+def np_rolling_mean(arr: np.ndarray, window: int, min_periods: int = None, out: np.ndarray = None) -> np.ndarray:
+    """
+    移動平均を計算します. NaNは無視します
+    """
+    x = _as_2d(arr).astype(np.float64, copy=False)
+    result = _output(np.asarray(arr), out)
+    r = _as_2d(result)
+    s, k = _window_sums(x, window)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r[:] = np.where(k >= (window if min_periods is None else min_periods), s / k, np.nan)
+    return result
+
+
+def np_rolling_std(arr: np.ndarray, window: int, min_periods: int = None, ddof: int = 1,
+                   out: np.ndarray = None) -> np.ndarray:
+    """
+    移動標準偏差を計算します. NaNは無視します
+    桁落ちを避けるため列の平均を引いてから2乗和を累積します
+    :param ddof: 自由度. pandasと同じ1がデフォルトです
+    """
+    x = _as_2d(arr).astype(np.float64, copy=False)
+    result = _output(np.asarray(arr), out)
+    r = _as_2d(result)
+    with np.errstate(invalid='ignore'):
+        center = np.nanmean(x, axis=0) if x.size else 0
+    x = x - np.where(np.isnan(center), 0, center)
+    s, k = _window_sums(x, window)
+    s2, _ = _window_sums(x, window, power=2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        var = (s2 - s * s / k) / (k - ddof)
+    var = np.maximum(var, 0)
+    r[:] = np.where((k >= (window if min_periods is None else min_periods)) & (k > ddof), np.sqrt(var), np.nan)
+    return result
+
+
+def np_rolling_zscore(arr: np.ndarray, window: int, min_periods: int = None, ddof: int = 1,
+                      out: np.ndarray = None) -> np.ndarray:
+    """
+    移動平均と移動標準偏差で標準化します((x - mean) / std)
+    """
+    x = _as_2d(arr).astype(np.float64, copy=False)
+    result = np_rolling_std(arr, window, min_periods, ddof, out)
+    r = _as_2d(result)
+    mean = np_rolling_mean(arr, window, min_periods)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        np.divide(x - _as_2d(mean), r, out=r)
+    r[~np.isfinite(r)] = np.nan
+    return result
+
+
+def _rolling_extreme(arr: np.ndarray, window: int, min_periods: int, out: np.ndarray, ufunc, fill: float) -> np.ndarray:
+    """
+    van Herk/Gil-Werman法で移動最大・最小を計算します
+    windowごとのブロックの前方累積と後方累積を組み合わせるため、計算量はwindowに依存しません
+    先頭のwindow-1行は先頭からの累積になります
+    """
+    x = _as_2d(arr).astype(np.float64, copy=False)
+    result = _output(np.asarray(arr), out)
+    r = _as_2d(result)
+    n, m = x.shape
+    filled = np.where(np.isnan(x), fill, x)
+    head = min(window - 1, n)
+    ufunc.accumulate(filled[:head], axis=0, out=r[:head])
+    if n >= window:
+        blocks = -(-n // window)
+        pad = np.full((blocks * window, m), fill)
+        pad[:n] = filled
+        pad = pad.reshape(blocks, window, m)
+        prefix = ufunc.accumulate(pad, axis=1).reshape(-1, m)
+        suffix = ufunc.accumulate(pad[:, ::-1], axis=1)[:, ::-1].reshape(-1, m)
+        # 窓[i-window+1, i]はsuffix[i-window+1]とprefix[i]の組み合わせになる
+        ufunc(suffix[:n - window + 1], prefix[window - 1:n], out=r[window - 1:])
+
+    _, k = _window_sums(x, window)
+    r[(k < (window if min_periods is None else min_periods)) | (k == 0)] = np.nan
+    return result
+
+
+def np_rolling_max(arr: np.ndarray, window: int, min_periods: int = None, out: np.ndarray = None) -> np.ndarray:
+    """
+    移動最大を計算します. NaNは無視します
+    """
+    return _rolling_extreme(arr, window, min_periods, out, np.maximum, -np.inf)
+
+
+def np_rolling_min(arr: np.ndarray, window: int, min_periods: int = None, out: np.ndarray = None) -> np.ndarray:
+    """
+    移動最小を計算します. NaNは無視します
+    """
+    return _rolling_extreme(arr, window, min_periods, out, np.minimum, np.inf)
+
+
+def np_ema(arr: np.ndarray, span: float = None, alpha: float = None, out: np.ndarray = None) -> np.ndarray:
+    """
+    指数移動平均を計算します(pandasのewm(adjust=False, ignore_na=True)と同じ値)
+    y[t] = alpha * x[t] + (1 - alpha) * y[t-1] をブロックごとの閉形式(累積積と累積和)で計算します
+    NaNの位置は直前の値を引き継ぎ、最初の有効な値より前はNaNになります
+    :param span: alpha = 2 / (span + 1)
+    :param alpha: 平滑化係数(0 < alpha <= 1)
+    """
+    if alpha is None:
+        if span is None:
+            raise ValueError('span or alpha should be specified.')
+        alpha = 2 / (span + 1)
+    if not 0 < alpha <= 1:
+        raise ValueError(f'alpha{alpha} should be in (0, 1].')
+
+    x = _as_2d(arr).astype(np.float64, copy=False)
+    result = _output(np.asarray(arr), out)
+    r = _as_2d(result)
+    n, m = x.shape
+    if n == 0:
+        return result
+
+    # 減衰の累積積が1e-100を下回らない長さでブロックに分ける
+    decay = 1 - alpha
+    block = n if decay == 0 else int(max(1, min(n, -100 / np.log10(decay))))
+
+    valid = ~np.isnan(x)
+    started = np.maximum.accumulate(valid, axis=0)
+    first = np.where(valid.any(axis=0), x[valid.argmax(axis=0), np.arange(m)], np.nan)
+    prev = first.copy()
+    for start in range(0, n, block):
+        stop = min(n, start + block)
+        v = valid[start:stop]
+        if decay == 0:
+            r[start:stop] = np.where(v, x[start:stop], np.nan)
+            r[start:stop] = _ffill(r[start:stop], prev)
+        else:
+            d = np.cumprod(np.where(v, decay, 1.0), axis=0)
+            w = np.where(v, alpha * x[start:stop], 0.0)
+            r[start:stop] = d * (prev + np.cumsum(w / d, axis=0))
+        prev = r[stop - 1].copy()
+        prev = np.where(np.isnan(prev), first, prev)
+    r[~started] = np.nan
+    return result
+
+
+def _ffill(x: np.ndarray, prev: np.ndarray) -> np.ndarray:
+    """
+    NaNを直前の値(先頭はprev)で埋めます
+    """
+    idx = np.where(~np.isnan(x), np.arange(x.shape[0])[:, None], -1)
+    np.maximum.accumulate(idx, axis=0, out=idx)
+    return np.where(idx >= 0, x[np.maximum(idx, 0), np.arange(x.shape[1])], prev)
@@ -2,23 +2,45 @@ import numpy as np
 import pandas as pd
 import polars as pl
 from datetime import datetime, timedelta
+from .io_util import scan_table, pl_datetime
 
 
-def df_list(df: pl.DataFrame, start_date: datetime, interval: int, quantity: int, dt_col: str="") -> list:
+def df_list(df: pl.DataFrame, start_date: datetime, interval: int, quantity: int, dt_col: str="",
+            lazy: bool = False):
+    """
+    dt_colでstart_dateからinterval日ごとの期間に分割します
+    境界はsearch_sortedでまとめて求め、各期間はコピーしないsliceで返します
+    dt_colが昇順でない場合は一度だけソートします
+    example
+    folds = df_list(df, datetime(2023, 1, 1), 30, 24, 'datetime')
+    :param lazy: Trueの場合はリストではなくジェネレータで返します
+    """
+    if not df[dt_col].is_sorted():
+        df = df.sort(dt_col)
+    col = df[dt_col]
+
     # 日付リストを生成する
+    end = col.max()
     date_list = [start_date + timedelta(days=interval*i)
-                for i in range(quantity)
-                if start_date + timedelta(days=interval*i) <= df[dt_col].max()]
+                 for i in range(quantity)
+                 if start_date + timedelta(days=interval*i) <= end]
+    pairs = [(i, i+1) for i in range(0, len(date_list)-1, interval)]
+    if len(date_list) % interval != 1 and len(date_list) >= 2:
+        pairs.append((len(date_list)-2, len(date_list)-1))
+    if not pairs:
+        return iter([]) if lazy else []
 
-    # DataFrameリストを生成する
-    return [df.filter((pl.col(dt_col).ge(start_date)) & (pl.col(dt_col).lt(end_date)))
-            for start_date, end_date in [(date_list[i], date_list[i+1])
-                for i in range(0, len(date_list)-1, interval)] + ([ (date_list[-2], date_list[-1]) ]
-                    if len(date_list) % interval != 1 else [])]
+    # start <= dt_col < end の範囲は[search_sorted(start), search_sorted(end))の行になる
+    bounds = col.search_sorted(pl.Series(date_list).cast(col.dtype), side='left').to_list()
+    frames = (df.slice(bounds[i], bounds[j] - bounds[i]) for i, j in pairs)
+    return frames if lazy else list(frames)
 
 
-def pl_merge(left, right, col):
-    return (left.join(right ,on=col, how="left")
+def _pl_fill(df, columns: list):
+    # EXTRA_AGGSの列は約定が無い足ではvwap=close, それ以外は0で埋める
+    extra = [pl.col(name).fill_null(pl.col("close") if name == "vwap" else 0)
+             for name in EXTRA_AGGS if name in columns]
+    return (df
             .with_columns(pl.col("close").fill_null(strategy="forward").fill_null(strategy="backward"))
             .with_columns([
                 pl.col("open").fill_null(pl.col("close")),
@@ -27,57 +49,336 @@ def pl_merge(left, right, col):
                 pl.col("volume").fill_null(0),
                 pl.col("buy_vol").fill_null(0),
                 pl.col("sell_vol").fill_null(0),
-            ]))
+            ] + extra))
+
+
+def pl_merge(left, right, col):
+    return _pl_fill(left.join(right ,on=col, how="left"), right.columns)
+
+
+def pl_fill_gaps(lf: pl.LazyFrame, time_frame: str, start: datetime = None, end: datetime = None,
+                 sparse: bool = False) -> pl.LazyFrame:
+    """
+    時刻順のohlcvの欠損した足をpl_mergeと同じ値で埋めます. LazyFrameのまま後続の処理に繋げられます
+    start, endを省略した場合は最初の足の日の0時から最後の足の日の23:59:59までを埋めます
+    example
+    pl_fill_gaps(pl_ohlcv(lf, TRADE_SCHEMAS['binance'], '1s'), '1s').collect()
+    :param time_frame: 足の時間軸
+    :param start: 最初の足の時刻
+    :param end: 最後の足の時刻(この時刻を含みます)
+    :param sparse: Trueの場合は欠損の先頭にだけ行を追加します. 各時刻の足は直前の行と同じ値で
+                   join_asof(strategy='backward')で元に戻せます
+    :return: polars.LazyFrame
+    """
+    lf = lf.lazy()
+    columns = lf.columns
+    dt = pl.col('datetime')
+    dtype = lf.schema['datetime']
+    lo = dt.min().dt.truncate('1d') if start is None else pl.lit(start).cast(dtype)
+    hi = dt.max().dt.truncate('1d').dt.offset_by('1d') - pl.duration(seconds=1) if end is None else pl.lit(end).cast(dtype)
+
+    if not sparse:
+        grid = lf.select(pl.datetime_range(lo, hi, time_frame).alias('datetime'))
+        return _pl_fill(grid.join(lf, on='datetime', how='left'), columns)
+
+    # 足の次の時刻に足が無ければ、そこから欠損が始まる
+    lf = lf.filter(dt.ge(lo) & dt.le(hi))
+    after = dt.dt.offset_by(time_frame)
+    gaps = (lf.filter(after.lt(dt.shift(-1)) | (dt.shift(-1).is_null() & after.le(hi)))
+            .select(after.alias('datetime')))
+    head = (lf.select([lo.alias('datetime'), dt.min().alias('first')])
+            .filter(pl.col('datetime').lt(pl.col('first')))
+            .select('datetime'))
+    return _pl_fill(pl.concat([lf, gaps, head], how='diagonal').sort('datetime'), columns)
+
+
+def scan_trades(path, dtypes: dict = None) -> pl.LazyFrame:
+    """
+    約定履歴をLazyFrameで読み込みます
+    ファイルパス(globも可)とそのリストは拡張子(csv/parquet)に応じてscanし、メモリに読み込まずに集計へ渡します
+    それ以外(URL, BytesIO)はcsvとして読み込みます
+    example
+    scan_trades('bitflyer/FX_BTC_JPY/trades/2023-01-*.csv')
+    :param dtypes: csvの列の型. 型推論が外れる列を指定します
+    """
+    if isinstance(path, (list, tuple)):
+        return pl.concat([scan_trades(p, dtypes) for p in path], how='vertical_relaxed')
+    if isinstance(path, str) and not path.startswith('http'):
+        if dtypes is not None and not path.endswith('.parquet'):
+            return pl.scan_csv(path, dtypes=dtypes)
+        return scan_table(path)
+    return pl.read_csv(path, dtypes=dtypes).lazy()
+
+
+def ohlcv_schema(date: str, price: str, size: str, side: str, buy, sell,
+                 multiplier: int = None, sorted: bool = True, dtypes: dict = None) -> dict:
+    """
+    約定履歴の列定義を作ります
+    :param date: 時刻の列
+    :param price: 価格の列
+    :param size: 数量の列
+    :param side: 売買方向の列. buy, sellはその値
+    :param multiplier: 時刻が数値の場合にマイクロ秒へ換算する倍率. Noneの場合は日時(文字列)として読みます
+    :param sorted: 時刻順に並んでいるか. Falseの場合は集計前にソートします
+    :param dtypes: csvを読み込む時の列の型(scan_trades参照)
+    """
+    return dict(date=date, price=price, size=size, side=side, buy=buy, sell=sell,
+                multiplier=multiplier, sorted=sorted, dtypes=dtypes)
+
+
+# 取引所ごとの約定履歴の列定義
+TRADE_SCHEMAS = {
+    'bitflyer': ohlcv_schema('exec_date', 'price', 'size', 'side', 'BUY', 'SELL'),
+    'gmo': ohlcv_schema('timestamp', 'price', 'size', 'side', 'BUY', 'SELL'),
+    'binance': ohlcv_schema('T', 'p', 'q', 'm', True, False, multiplier=1_000),
+    'bitbank': ohlcv_schema('executed_at', 'price', 'amount', 'side', 'buy', 'sell', multiplier=1_000),
+    'bybit': ohlcv_schema('timestamp', 'price', 'size', 'side', 'Buy', 'Sell', multiplier=1_000_000,
+                          dtypes={'timestamp': pl.Float64, 'price': pl.Float64, 'size': pl.Float64}),
+}
+
+
+def _pl_trades(lf: pl.LazyFrame, schema: dict, price_type: pl.DataType = None,
+               size_type: pl.DataType = None) -> pl.LazyFrame:
+    """
+    約定履歴をdatetime, price, size, buy_size, sell_sizeの列に揃えて時刻順にします
+    """
+    price, size, side = pl.col(schema['price']), pl.col(schema['size']), pl.col(schema['side'])
+    if schema['multiplier'] is None:
+        dt = pl_datetime(lf, schema['date'])
+    else:
+        dt = (pl.col(schema['date']) * schema['multiplier']).cast(pl.Datetime(time_unit='us'))
+    if price_type is not None:
+        price = price.cast(price_type)
+    if size_type is not None:
+        size = size.cast(size_type)
+
+    lf = lf.select([dt.alias('datetime'),
+                    price.alias('price'),
+                    size.alias('size'),
+                    pl.when(side == schema['buy']).then(size).otherwise(0).alias('buy_size'),
+                    pl.when(side == schema['sell']).then(size).otherwise(0).alias('sell_size')])
+    return lf.set_sorted('datetime') if schema['sorted'] else lf.sort('datetime')
+
+
+# ohlcvと同じ集計で追加できる列 (_pl_tradesの列から計算します)
+EXTRA_AGGS = {
+    'vwap': (pl.col('price') * pl.col('size')).sum() / pl.col('size').sum(),
+    'trades': pl.col('price').count(),
+    'buy_trades': (pl.col('buy_size') > 0).sum(),
+    'sell_trades': (pl.col('sell_size') > 0).sum(),
+    'max_size': pl.col('size').max(),
+    'realized_var': (pl.col('price').cast(pl.Float64).log().diff() ** 2).sum(),
+}
+
+
+def _extra_aggs(extra: list) -> list:
+    if extra is None:
+        return []
+    unknown = [name for name in extra if name not in EXTRA_AGGS]
+    if unknown:
+        raise ValueError(f'extra{unknown} should be in {list(EXTRA_AGGS)}.')
+    return [EXTRA_AGGS[name].alias(name) for name in extra]
+
+
+def pl_ohlcv(lf: pl.LazyFrame, schema: dict, time_frame: str, price_type: pl.DataType = None,
+             size_type: pl.DataType = None, extra: list = None, streaming: bool = False) -> pl.LazyFrame:
+    """
+    約定履歴からohlcv(open, high, low, close, volume, buy_vol, sell_vol)を集計します
+    example
+    pl_ohlcv(pl.scan_csv(path), TRADE_SCHEMAS['bitflyer'], '1m', pl.Int64, extra=['vwap', 'trades']).collect()
+    :param schema: TRADE_SCHEMASの値かohlcv_schema()
+    :param price_type: 価格の型. Noneの場合は変換しません
+    :param size_type: 数量の型. Noneの場合は変換しません
+    :param extra: 同じ集計で追加する列(EXTRA_AGGSのキー). vwap, trades, buy_trades, sell_trades, max_size, realized_var
+    :param streaming: Trueの場合はgroup_by_dynamicの代わりに時刻を切り捨てたgroup_byで集計します
+                      collect(streaming=True)で約定全体をメモリに載せずに集計できます
+    :return: polars.LazyFrame
+    """
+    aggs = [
+        pl.col('price').first().alias('open'),
+        pl.col('price').max().alias('high'),
+        pl.col('price').min().alias('low'),
+        pl.col('price').last().alias('close'),
+        pl.col('size').sum().alias('volume'),
+        pl.col('buy_size').sum().alias('buy_vol'),
+        pl.col('sell_size').sum().alias('sell_vol')
+    ] + _extra_aggs(extra)
+    lf = _pl_trades(lf, schema, price_type, size_type)
+    if streaming:
+        return (lf
+                .group_by(pl.col('datetime').dt.truncate(time_frame))
+                .agg(aggs)
+                .sort('datetime'))
+    return lf.group_by_dynamic('datetime', every=time_frame).agg(aggs)
 
 
 def make_ohlcv(path: str, date_column_name: str, price_column_name: str,
-               size_column_name: str, side_column_name: str, buy, sell, time_frame, pl_type: pl.DataType) -> pl.DataFrame:
-    return (pl.read_csv(path)
-            .lazy()
-            .with_columns([pl.col(date_column_name).str.strptime(pl.Datetime, strict=False).alias("datetime"),
-                        pl.col(price_column_name).cast(pl_type),
-                        pl.when(pl.col(side_column_name) == buy).then(pl.col(size_column_name)).otherwise(0).alias('buy_size'),
-                        pl.when(pl.col(side_column_name) == sell).then(pl.col(size_column_name)).otherwise(0).alias('sell_size')])
-            .set_sorted("datetime")
-            .group_by_dynamic('datetime', every=time_frame)
-            .agg([
-                pl.col(price_column_name).first().alias('open'),
-                pl.col(price_column_name).max().alias('high'),
-                pl.col(price_column_name).min().alias('low'),
-                pl.col(price_column_name).last().alias('close'),
-                pl.col(size_column_name).sum().alias('volume'),
-                pl.col('buy_size').sum().alias('buy_vol'),
-                pl.col('sell_size').sum().alias('sell_vol')
-                ])
-            .collect()
-            )
+               size_column_name: str, side_column_name: str, buy, sell, time_frame, pl_type: pl.DataType,
+               extra: list = None, streaming: bool = False) -> pl.DataFrame:
+    """
+    :param path: ファイルパス(globも可), そのリスト, URL, BytesIO
+    :param streaming: Trueの場合は約定をメモリに載せずにpolarsのstreamingエンジンで集計します(pl_ohlcv参照)
+    """
+    schema = ohlcv_schema(date_column_name, price_column_name, size_column_name, side_column_name, buy, sell)
+    return pl_ohlcv(scan_trades(path), schema, time_frame, pl_type, extra=extra,
+                    streaming=streaming).collect(streaming=streaming)
 
 
 def make_ohlcv_from_timestamp(path: str, date_column_name: str, price_column_name: str,
                               size_column_name: str, side_column_name: str, buy, sell,
-                              time_frame, pl_type: pl.DataType, timestamp_multiplier: int) -> pl.DataFrame:
-    return (pl.read_csv(path)
-            .lazy()
-            .with_columns([(pl.col(date_column_name) * timestamp_multiplier)
-                           .cast(pl.Datetime(time_unit='us')).alias("datetime"),
-                           pl.col(price_column_name).cast(pl_type),
-                           pl.when(pl.col(side_column_name) == buy)
-                           .then(pl.col(size_column_name)).otherwise(0).alias('buy_size'),
-                           pl.when(pl.col(side_column_name) == sell)
-                           .then(pl.col(size_column_name)).otherwise(0).alias('sell_size')])
-            .set_sorted("datetime")
-            .group_by_dynamic('datetime', every=time_frame)
-            .agg([
-                pl.col(price_column_name).first().alias('open'),
-                pl.col(price_column_name).max().alias('high'),
-                pl.col(price_column_name).min().alias('low'),
-                pl.col(price_column_name).last().alias('close'),
-                pl.col(size_column_name).sum().alias('volume'),
-                pl.col('buy_size').sum().alias('buy_vol'),
-                pl.col('sell_size').sum().alias('sell_vol')
-            ])
-            .collect()
-            )
+                              time_frame, pl_type: pl.DataType, timestamp_multiplier: int,
+                              extra: list = None, streaming: bool = False) -> pl.DataFrame:
+    """
+    :param path: ファイルパス(globも可), そのリスト, URL, BytesIO
+    :param streaming: Trueの場合は約定をメモリに載せずにpolarsのstreamingエンジンで集計します(pl_ohlcv参照)
+    """
+    schema = ohlcv_schema(date_column_name, price_column_name, size_column_name, side_column_name, buy, sell,
+                          multiplier=timestamp_multiplier)
+    return pl_ohlcv(scan_trades(path), schema, time_frame, pl_type, extra=extra,
+                    streaming=streaming).collect(streaming=streaming)
+
+
+# 時間軸の単位(秒)
+_TIME_FRAME_UNITS = {'s': 1, 'm': 60, 'h': 3_600, 'd': 86_400, 'w': 604_800}
+
+
+def _time_frame_seconds(time_frame: str) -> int:
+    """
+    1s, 5m, 1h, 1d のような時間軸を秒に変換します
+    """
+    n, unit = time_frame[:-1], time_frame[-1:]
+    if not n.isdigit() or unit not in _TIME_FRAME_UNITS:
+        raise ValueError(f'time_frame{time_frame} should be like 1s, 5m, 1h, 1d, 1w.')
+    return int(n) * _TIME_FRAME_UNITS[unit]
+
+
+def pl_ohlcv_multi(lf: pl.LazyFrame, schema: dict, time_frames: list, price_type: pl.DataType = None,
+                   size_type: pl.DataType = None, extra: list = None, streaming: bool = False) -> dict:
+    """
+    約定履歴を1回だけ集計して複数の時間軸のohlcvを返します
+    最も短い時間軸を約定から集計し、長い時間軸はそれを割り切れる中で最も長い足からpl_resample_ohlcvで作ります
+    example
+    pl_ohlcv_multi(pl.scan_csv(path), TRADE_SCHEMAS['bitflyer'], ['1s', '1m', '5m', '1h'], pl.Int64)['5m']
+    :param time_frames: 1s, 1m, 5m, 1h 等のリスト. 短い時間軸で割り切れない時間軸は指定できません
+    :return: {time_frame: polars.DataFrame}
+    """
+    frames = sorted(set(time_frames), key=_time_frame_seconds)
+    result = {frames[0]: pl_ohlcv(lf, schema, frames[0], price_type, size_type, extra, streaming)
+              .collect(streaming=streaming)}
+    for time_frame in frames[1:]:
+        seconds = _time_frame_seconds(time_frame)
+        sources = [tf for tf in result if seconds % _time_frame_seconds(tf) == 0]
+        if not sources:
+            raise ValueError(f'time_frame{time_frame} is not a multiple of {frames[0]}.')
+        result[time_frame] = pl_resample_ohlcv(result[sources[-1]], time_frame)
+    return {time_frame: result[time_frame] for time_frame in time_frames}
+
+
+def make_ohlcv_multi(path: str, schema, time_frames: list, pl_type: pl.DataType, extra: list = None,
+                     streaming: bool = False) -> dict:
+    """
+    約定履歴のファイルを1回だけ読んで複数の時間軸のohlcvを返します
+    example
+    make_ohlcv_multi('bitflyer/FX_BTC_JPY/trades/2023-01-01.csv', 'bitflyer', ['1s', '1m', '1h'], pl.Int64)
+    :param schema: TRADE_SCHEMASのキーかohlcv_schema()
+    """
+    if isinstance(schema, str):
+        schema = TRADE_SCHEMAS[schema]
+    return pl_ohlcv_multi(scan_trades(path, schema['dtypes']), schema, time_frames, pl_type, extra=extra,
+                          streaming=streaming)
+
+
+BAR_TYPES = ('tick', 'volume', 'dollar', 'imbalance', 'tick_imbalance')
+
+
+def _imbalance_ends(signed: np.ndarray, threshold: float) -> np.ndarray:
+    """
+    バーの開始から累積した符号付きの値の絶対値がthresholdに達した位置を返します
+    バー毎に前回のバーの長さを目安にした範囲だけcumsumで探します
+    """
+    ends = []
+    i, n, window = 0, len(signed), 1024
+    while i < n:
+        while True:
+            hit = np.flatnonzero(np.abs(np.cumsum(signed[i:i + window])) >= threshold)
+            if len(hit) or i + window >= n:
+                break
+            window *= 2
+        if not len(hit):
+            break
+        ends.append(i + hit[0])
+        window = max(1024, int(hit[0] + 1) * 2)
+        i += hit[0] + 1
+    return np.array(ends, dtype=np.int64)
+
+
+def np_bar_ends(price: np.ndarray, size: np.ndarray, buy_size: np.ndarray, sell_size: np.ndarray,
+                bar_type: str, threshold: float) -> np.ndarray:
+    """
+    各バーの最後の約定の位置を返します
+    tick: 約定回数, volume: 数量, dollar: 価格x数量 の累積がthresholdの倍数を超えた約定でバーを閉じます
+    imbalance: 買い数量-売り数量, tick_imbalance: 買い約定数-売り約定数 の累積の絶対値がthresholdに達した約定でバーを閉じます
+    """
+    n = len(price)
+    if bar_type == 'tick':
+        return np.arange(int(threshold) - 1, n, int(threshold))
+    if bar_type in ('volume', 'dollar'):
+        values = size if bar_type == 'volume' else price.astype(np.float64) * size
+        cum = np.cumsum(values)
+        levels = np.arange(1, int(cum[-1] // threshold) + 1) * threshold if n else np.empty(0)
+        return np.unique(np.searchsorted(cum, levels, side='left'))
+    if bar_type == 'imbalance':
+        return _imbalance_ends(buy_size - sell_size, threshold)
+    if bar_type == 'tick_imbalance':
+        return _imbalance_ends(np.sign(buy_size) - np.sign(sell_size), threshold)
+    raise ValueError(f'bar_type{bar_type} should be one of {BAR_TYPES}.')
+
+
+def pl_bars(lf: pl.LazyFrame, schema: dict, bar_type: str, threshold: float, price_type: pl.DataType = None,
+            size_type: pl.DataType = None, keep_last: bool = False) -> pl.DataFrame:
+    """
+    約定履歴からtick, volume, dollar, imbalanceバーを作ります
+    列はpl_ohlcvと同じで、datetimeはバーの最後の約定の時刻です
+    example
+    pl_bars(pl.scan_csv(path), TRADE_SCHEMAS['binance'], 'dollar', 50_000_000)
+    :param bar_type: tick, volume, dollar, imbalance, tick_imbalance
+    :param threshold: バーを閉じる約定回数・数量・金額・不均衡
+    :param keep_last: Trueの場合はthresholdに達していない最後のバーも返します
+    """
+    df = _pl_trades(lf, schema, price_type, size_type).collect()
+    price = df['price'].to_numpy()
+    size = df['size'].to_numpy()
+    buy_size = df['buy_size'].to_numpy()
+    sell_size = df['sell_size'].to_numpy()
+
+    ends = np_bar_ends(price, size, buy_size, sell_size, bar_type, threshold)
+    if keep_last and len(df) and (len(ends) == 0 or ends[-1] != len(df) - 1):
+        ends = np.append(ends, len(df) - 1)
+    starts = np.concatenate(([0], ends[:-1] + 1)).astype(np.int64) if len(ends) else ends
+
+    return pl.DataFrame({
+        'datetime': df['datetime'].gather(ends),
+        'open': df['price'].gather(starts),
+        'high': pl.Series(np.maximum.reduceat(price, starts) if len(ends) else price[:0]).cast(df['price'].dtype),
+        'low': pl.Series(np.minimum.reduceat(price, starts) if len(ends) else price[:0]).cast(df['price'].dtype),
+        'close': df['price'].gather(ends),
+        'volume': np.add.reduceat(size, starts) if len(ends) else size[:0],
+        'buy_vol': np.add.reduceat(buy_size, starts) if len(ends) else buy_size[:0],
+        'sell_vol': np.add.reduceat(sell_size, starts) if len(ends) else sell_size[:0],
+    })
+
+
+def make_bars(path: str, schema, bar_type: str, threshold: float, pl_type: pl.DataType = pl.Float64,
+              keep_last: bool = False) -> pl.DataFrame:
+    """
+    約定履歴のファイルからtick, volume, dollar, imbalanceバーを作ります
+    example
+    make_bars('binance/trades/BTCUSDT/2023-01-01.csv', 'binance', 'volume', 100)
+    :param schema: TRADE_SCHEMASのキーかohlcv_schema()
+    """
+    if isinstance(schema, str):
+        schema = TRADE_SCHEMAS[schema]
+    return pl_bars(scan_trades(path, schema['dtypes']), schema, bar_type, threshold, pl_type, keep_last=keep_last)
 
 
 def np_shift(arr, num=1, fill_value=np.nan):
@@ -118,6 +419,131 @@ def np_pct_change_shift(arr, num, fill_value=np.nan):
     return np_shift(np_pct_change(arr, num, fill_value), -num, fill_value)
 
 
+def _lag_view(arr: np.ndarray, lags: list, fill_value, dtype) -> np.ndarray:
+    """
+    等差数列のlagsについて、前後をfill_valueで埋めた1本の配列へのストライドビューを返します
+    """
+    n, step = len(arr), lags[1] - lags[0] if len(lags) > 1 else 0
+    head, tail = max(max(lags), 0), max(-min(lags), 0)
+    padded = np.empty(n + head + tail, dtype=dtype)
+    padded[:head] = fill_value
+    padded[head:head + n] = arr
+    padded[head + n:] = fill_value
+    # M[i, j] = padded[head + i - lags[j]]
+    itemsize = padded.itemsize
+    view = np.lib.stride_tricks.as_strided(padded[head - lags[0]:], shape=(n, len(lags)),
+                                           strides=(itemsize, -step * itemsize), writeable=False)
+    return view
+
+
+def np_lag_matrix(arr: np.ndarray, lags: list, kind: str = 'shift', fill_value=np.nan,
+                  dtype=np.float64, out: np.ndarray = None) -> np.ndarray:
+    """
+    lagsごとにnp_shift(kind='pct_change'はnp_pct_change, 'pct_change_shift'はnp_pct_change_shift)した列を
+    並べた(n, len(lags))の行列を1回で作ります
+    kind='shift'でlagsが等差数列(1, 2, 3...等)かつoutを指定しない場合は、パディングした配列1本への
+    読み取り専用のビューを返すので行列分のメモリを使いません
+    それ以外は列ごとの一時配列を作らずにout(省略時は列優先(order='F')で新しく確保)へ直接書き込みます
+    example
+    X = np_lag_matrix(close, range(1, 201), 'pct_change', dtype=np.float32)
+    :param lags: シフト数のリスト. 負の値は先の値になります
+    :param kind: shift, pct_change, pct_change_shift
+    :param dtype: np.float64, np.float32
+    :param out: 書き込み先の(n, len(lags))の配列
+    """
+    arr = np.asarray(arr)
+    lags = [int(lag) for lag in lags]
+    n, k = len(arr), len(lags)
+    if kind not in ('shift', 'pct_change', 'pct_change_shift'):
+        raise ValueError(f'kind{kind} should be shift, pct_change or pct_change_shift.')
+    if k == 0:
+        raise ValueError('lags should not be empty.')
+
+    if kind == 'shift' and out is None and (k == 1 or len(set(np.diff(lags))) == 1):
+        return _lag_view(arr, lags, fill_value, dtype)
+
+    if out is None:
+        # 列ごとに書き込むので列が連続したメモリ配置にする
+        out = np.empty((n, k), dtype=dtype, order='F')
+    elif out.shape != (n, k):
+        raise ValueError(f'out.shape{out.shape} should be {(n, k)}.')
+    x = arr.astype(out.dtype, copy=False)
+
+    for j, lag in enumerate(lags):
+        col = out[:, j]
+        m = min(abs(lag), n)
+        if kind == 'shift':
+            if lag > 0:
+                col[:m] = fill_value
+                col[m:] = x[:n - m]
+            elif lag < 0:
+                col[n - m:] = fill_value
+                col[:n - m] = x[m:]
+            else:
+                col[:] = x
+            continue
+
+        # pct_change: (x[i] / x[i-lag] - 1) * 100, pct_change_shift: それを-lagだけシフトしたもの
+        new, old = (x[m:], x[:n - m]) if lag >= 0 else (x[:n - m], x[m:])
+        if kind == 'pct_change_shift':
+            body, fill = (col[:n - m], col[n - m:]) if lag >= 0 else (col[m:], col[:m])
+        else:
+            body, fill = (col[m:], col[:m]) if lag >= 0 else (col[:n - m], col[n - m:])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            np.divide(new, old, out=body)
+        body -= 1
+        body *= 100
+        if kind == 'pct_change':
+            # np_pct_changeと同じくfill_valueで割った値になる
+            with np.errstate(divide='ignore', invalid='ignore'):
+                fill[:] = ((x[:m] if lag >= 0 else x[n - m:]) / fill_value - 1) * 100
+        else:
+            fill[:] = fill_value
+    return out
+
+
+def _pl_rollup(columns: list) -> list:
+    """
+    連続した足を1本にまとめる集計式を返します(_pl_with_gapを適用した後に使います)
+    EXTRA_AGGSの列はvwapを出来高で加重し、realized_varには足の間のリターンも加えます
+    """
+    aggs = [
+        pl.col("open").first().alias("open"),
+        pl.col("high").max().alias("high"),
+        pl.col("low").min().alias("low"),
+        pl.col("close").last().alias("close"),
+        pl.col("volume").sum().alias("volume"),
+        pl.col("buy_vol").sum().alias("buy_vol"),
+        pl.col("sell_vol").sum().alias("sell_vol")
+    ]
+    for name in EXTRA_AGGS:
+        if name not in columns:
+            continue
+        if name == "vwap":
+            agg = (pl.when(pl.col("volume").sum() > 0)
+                   .then((pl.col("vwap") * pl.col("volume")).sum() / pl.col("volume").sum())
+                   .otherwise(pl.col("close").last()))
+        elif name == "max_size":
+            agg = pl.col(name).max()
+        elif name == "realized_var":
+            # 先頭の足の前のリターンは含めない
+            agg = (pl.col(name) + pl.col("_gap")).sum() - pl.col("_gap").first()
+        else:
+            agg = pl.col(name).sum()
+        aggs.append(agg.alias(name))
+    return aggs
+
+
+def _pl_with_gap(df):
+    """
+    realized_varがある場合に前の足のcloseから次の足のopenまでの対数リターンの2乗(_gap)を追加します
+    """
+    if "realized_var" not in df.columns:
+        return df
+    price = pl.col("open").cast(pl.Float64).log() - pl.col("close").cast(pl.Float64).log().shift(1)
+    return df.with_columns((price ** 2).fill_null(0).alias("_gap"))
+
+
 def pl_resample_ohlcv(df: pl.DataFrame, time_frame: str) -> pl.DataFrame:
     """""""""
     時間軸をリサンプリングします
@@ -125,18 +551,10 @@ def pl_resample_ohlcv(df: pl.DataFrame, time_frame: str) -> pl.DataFrame:
     :param time_frame: 1s, 1m, 1h, 1d
     :return: polars.DataFrame
     """""""""
-    return df.group_by_dynamic(
+    return _pl_with_gap(df).group_by_dynamic(
         "datetime",
         every=time_frame
-        ).agg([
-            pl.col("open").first().alias("open"),
-            pl.col("high").max().alias("high"),
-            pl.col("low").min().alias("low"),
-            pl.col("close").last().alias("close"),
-            pl.col("volume").sum().alias("volume"),
-            pl.col("buy_vol").sum().alias("buy_vol"),
-            pl.col("sell_vol").sum().alias("sell_vol")
-        ])
+        ).agg(_pl_rollup(df.columns))
 
 
 def resample_ohlc(org_df, timeframe):
@@ -6,5 +6,5 @@ setup(
     version='8.0.1',
     author='lawn',
     url='https://github.com/lawnn/fetcher.git',
-    install_requires=['requests', 'asyncio', 'matplotlib', 'plotly', 'pandas', 'numpy', 'polars', 'pytz', 'ccxt']
+    install_requires=['requests', 'asyncio', 'matplotlib', 'plotly', 'pandas', 'numpy', 'polars', 'pyarrow', 'pytz', 'ccxt']
 )
@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+
+from fetcher.analyze_util import Optimization
+
+
+class _NaNOptimization(Optimization):
+    def indicator(self, length, threshold):
+        return np.nan if length == 5 else float(length + threshold)
+
+
+@pytest.mark.parametrize('direction', ['maximize', 'minimize'])
+def test_grid_search_nan_last(direction):
+    result = _NaNOptimization(None, {'length': (5, 15, 5), 'threshold': (1, 2, 1)}).grid_search(direction=direction)
+    assert result['length'].to_list()[-2:] == [5, 5]
+    assert result['value'].null_count() == 2
+    best = result.row(0, named=True)
+    assert (best['length'], best['threshold']) == ((15, 2) if direction == 'maximize' else (10, 1))
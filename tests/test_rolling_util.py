@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from fetcher.rolling_util import (np_rolling_sum, np_rolling_mean, np_rolling_std, np_rolling_zscore,
+                                  np_rolling_min, np_rolling_max)
+
+
+def _data(n: int = 50) -> np.ndarray:
+    x = np.random.default_rng(0).standard_normal(n).cumsum()
+    x[[3, 4, 10, 30]] = np.nan
+    return x
+
+
+def _pandas(x: np.ndarray, window: int, min_periods: int, name: str) -> np.ndarray:
+    rolling = pd.Series(x).rolling(window, min_periods=min_periods)
+    if name == 'zscore':
+        return ((pd.Series(x) - rolling.mean()) / rolling.std()).to_numpy()
+    return getattr(rolling, name)().to_numpy()
+
+
+FUNCS = {
+    'sum': np_rolling_sum,
+    'mean': np_rolling_mean,
+    'std': np_rolling_std,
+    'zscore': np_rolling_zscore,
+    'min': np_rolling_min,
+    'max': np_rolling_max,
+}
+
+
+@pytest.mark.parametrize('name', list(FUNCS))
+@pytest.mark.parametrize('window, min_periods', [(5, None), (5, 1), (5, 3), (8, 2), (80, 1), (80, None)])
+def test_matches_pandas(name, window, min_periods):
+    x = _data()
+    expected = _pandas(x, window, window if min_periods is None else min_periods, name)
+    np.testing.assert_allclose(FUNCS[name](x, window, min_periods), expected, rtol=1e-9, atol=1e-9)
+
+
+def test_min_periods_leading_rows():
+    np.testing.assert_allclose(np_rolling_mean(np.arange(1, 11), 4, min_periods=1)[:4], [1, 1.5, 2, 2.5])
+
+
+@pytest.mark.parametrize('name', list(FUNCS))
+def test_columns(name):
+    x = np.column_stack([_data(), _data()[::-1]])
+    result = FUNCS[name](x, 6, 2)
+    for i in range(x.shape[1]):
+        np.testing.assert_allclose(result[:, i], _pandas(x[:, i], 6, 2, name), rtol=1e-9, atol=1e-9)